@@ -25,13 +25,33 @@ from sklearn.svm import SVR
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
-from skopt import gp_minimize
 from skopt.space import Real
+from ensemble_cv import compute_oof_predictions, fit_model, prune_weights, WeightedEnsemble
+from fold_cache import FoldCache
+from gp_cv import ClosedFormCVPipeline
+from gp_warm_start import WarmStartGaussianProcessRegressor
+from knn_index import IndexedKNNPipeline
+from svr_kernel import SharedKernelSVR
+from weight_optimization import (batch_gp_minimize, calls_to_reach, fit_simplex_weights, gp_minimize_simplex,
+                                 gp_minimize_with_checkpoint, sample_simplex_weights, sweep_weights)
 s
+# 'per_fold' refits the GP on every fold, 'closed_form' derives the predictions of all folds from one
+# Cholesky factorization of the full training kernel (kernel hyperparameters and scaler are then fitted
+# once on all training rows instead of per fold)
+gp_cv_mode = 'per_fold'
+gp_pipeline = ClosedFormCVPipeline if gp_cv_mode == 'closed_form' else Pipeline
+# 'per_fold' refits the KNN on every fold, 'shared_index' builds one neighbor index over all training rows
+# and answers every fold by masking its validation rows (distances use the full-train scaling)
+knn_cv_mode = 'per_fold'
+knn_pipeline = IndexedKNNPipeline if knn_cv_mode == 'shared_index' else Pipeline
+# True warm-starts every GP fit from the kernel hyperparameters the previous fit (or run) left in its
+# *_gp_kernel.joblib store, False fits every fold from scratch so the folds do not depend on each other
+warm_start_gp = False
+
 model_definitions = {
     'SVR': Pipeline([
         ('scaler', StandardScaler()),
-        ('model', SVR(C=1000, epsilon=1.0, gamma=0.0001, kernel='rbf'))
+        ('model', SharedKernelSVR(C=1000, epsilon=1.0, gamma=0.0001, kernel='rbf'))
     ]),
     'RandomForest': Pipeline([
         ('scaler', StandardScaler()),
@@ -43,11 +63,14 @@ model_definitions = {
         ('model', ExtraTreesRegressor(bootstrap=False, max_depth=30, min_samples_leaf=2,
                                       min_samples_split=2, n_estimators=300, random_state=42))
     ]),
-    'GaussianProcess': Pipeline([
+    # with warm_start_gp the kernel hyperparameters of the previous fold/run seed the next fit, restarts
+    # only run when the log-marginal-likelihood degrades
+    'GaussianProcess': gp_pipeline([
         ('scaler', StandardScaler()),
-        ('model', GaussianProcessRegressor(alpha=1e-10, n_restarts_optimizer=2))
+        ('model', WarmStartGaussianProcessRegressor(alpha=1e-10, n_restarts_optimizer=2,
+                                                    kernel_store='Am_M2_gp_kernel.joblib' if warm_start_gp else None))
     ]),
-    'KNN': Pipeline([
+    'KNN': knn_pipeline([
         ('scaler', StandardScaler()),
         ('model', KNeighborsRegressor(n_neighbors=8, p=1, weights='distance'))
     ])
@@ -61,59 +84,65 @@ X_train, X_test, y_train, y_test = train_test_split(X, ya, test_size=0.2, random
 
 kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
-def evaluate_ensemble(weights):
+# fitted fold models and predictions are stored on disk and reused by the later sections
+fold_cache = FoldCache('fold_cache')
+
+# base-model predictions do not depend on the weights, so every model is fitted on every fold only once,
+# the 25 fold x model fits run on a process pool (n_jobs=-1 uses every core), every fold is standardized
+# once for all members (share_scaling=True)
+oof = compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf,
+                              model_names=['RandomForest', 'SVR', 'ExtraTrees', 'GaussianProcess', 'KNN'],
+                              n_jobs=-1, cache=fold_cache, share_scaling=True)
 
+def evaluate_ensemble(weights):
     weight_sum = sum(weights)
     normalized_weights = [w / weight_sum for w in weights]
-    rf_weight, svr_weight, et_weight, gp_weight, knn_weight = normalized_weights
-
-    y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-    y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-    for train_idx, valid_idx in kf.split(X_train):
-        X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-        y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-        fold_train_predictions = {}
-        fold_test_predictions = {}
-        for model_name, pipeline in model_definitions.items():
-            pipeline.fit(X_train_fold, y_train_fold)
-            fold_train_predictions[model_name] = pipeline.predict(X_valid_fold)
-            fold_test_predictions[model_name] = pipeline.predict(X_test)
-
-
-        fold_train_ensemble = (rf_weight * fold_train_predictions['RandomForest'] +
-                               svr_weight * fold_train_predictions['SVR'] +
-                               et_weight * fold_train_predictions['ExtraTrees'] +
-                               gp_weight * fold_train_predictions['GaussianProcess'] +
-                               knn_weight * fold_train_predictions['KNN'])
-        fold_test_ensemble = (rf_weight * fold_test_predictions['RandomForest'] +
-                              svr_weight * fold_test_predictions['SVR'] +
-                              et_weight * fold_test_predictions['ExtraTrees'] +
-                              gp_weight * fold_test_predictions['GaussianProcess'] +
-                              knn_weight * fold_test_predictions['KNN'])
-
-        y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-        y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
-
-    val_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
-    return val_rmse
+    return oof.rmse(normalized_weights)
 
 search_space = [Real(0, 1, name=name) for name in ['rf_weight', 'svr_weight', 'et_weight', 'gp_weight', 'knn_weight']]
 
 def objective(weights):
     return evaluate_ensemble(weights)
 
-result = gp_minimize(objective, search_space, n_calls=50, random_state=42)
-optimal_weights = [w / sum(result.x) for w in result.x]
+# weight_solver options:
+#   'simplex'             optimal non-negative, sum-to-one weights computed directly
+#   'sweep'               random Dirichlet candidates scored in one batch
+#   'gp_minimize'         Bayesian search over five Real(0, 1) weights, normalized afterwards,
+#                         with early stopping and checkpoint/resume
+#   'gp_minimize_batch'   the same search evaluated in concurrent batches of 4 points
+#   'gp_minimize_simplex' Bayesian search directly on the 4-dimensional simplex
+weight_solver = 'simplex'
+
+if weight_solver == 'simplex':
+    optimal_weights = list(fit_simplex_weights(oof))
+elif weight_solver == 'sweep':
+    candidate_weights = sample_simplex_weights(100000, len(oof.model_names), random_state=42)
+    optimal_weights = list(sweep_weights(oof, candidate_weights)[0])
+elif weight_solver == 'gp_minimize_batch':
+    result = batch_gp_minimize(objective, search_space, n_calls=50, batch_size=4, random_state=42)
+    optimal_weights = [w / sum(result.x) for w in result.x]
+elif weight_solver == 'gp_minimize_simplex':
+    result = gp_minimize_simplex(evaluate_ensemble, oof.model_names, n_calls=50, random_state=42)
+    optimal_weights = list(result.weights)
+    target_rmse = oof.rmse(fit_simplex_weights(oof))
+    print(f"Calls needed to reach the optimal RMSE {target_rmse:.4f} (within 0.1%): "
+          f"{calls_to_reach(result.func_vals, target_rmse)}")
+else:
+    # stops after 15 calls without an RMSE improvement above 1e-4 and checkpoints every call,
+    # an interrupted run resumes from the checkpoint (delete it to start over)
+    result = gp_minimize_with_checkpoint(objective, search_space, n_calls=50, random_state=42,
+                                         checkpoint_path='Am_M2_weight_search.pkl', resume=True,
+                                         tol=1e-4, patience=15)
+    optimal_weights = [w / sum(result.x) for w in result.x]
 
 rf_weight, svr_weight, et_weight, gp_weight, knn_weight = optimal_weights
 print(f"Optimal Weights: RF={rf_weight:.4f}, SVR={svr_weight:.4f}, ET={et_weight:.4f}, GP={gp_weight:.4f}, KNN={knn_weight:.4f}")
 
-y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-for model_name, pipeline in model_definitions.items():
-    pipeline.fit(X_train, y_train)
-    y_test_pred_ensemble += optimal_weights.pop(0) * pipeline.predict(X_test)
+# only the members with a non-zero weight are refitted on the full training set
+ensemble_weights = prune_weights(dict(zip(model_definitions, optimal_weights)))
+fitted_models = {model_name: fit_model(model_definitions[model_name], X_train, y_train, cache=fold_cache)
+                 for model_name in ensemble_weights}
+y_test_pred_ensemble = WeightedEnsemble(fitted_models, ensemble_weights).predict(X_test)
 
 test_rmse = np.sqrt(mean_squared_error(y_test, y_test_pred_ensemble))
 test_r2 = r2_score(y_test, y_test_pred_ensemble)
@@ -130,6 +159,7 @@ from sklearn.neighbors import KNeighborsRegressor
 from sklearn.svm import SVR
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
+from ensemble_cv import compute_oof_predictions, prune_weights
 
 
 model_definitions = {
@@ -167,39 +197,13 @@ knn_weight, svr_weight, rfr_weight, et_weight, gp_weight = optimal_weights
 
 kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
-y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-for train_idx, valid_idx in kf.split(X_train):
-    X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-    y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-    fold_train_predictions = {}
-    fold_test_predictions = {}
-
-    for model_name in model_definitions:
-        model = model_definitions[model_name]
-        model.fit(X_train_fold, y_train_fold)
-        y_valid_pred = model.predict(X_valid_fold)
-        y_test_pred = model.predict(X_test)
-
-        fold_train_predictions[model_name] = y_valid_pred
-        fold_test_predictions[model_name] = y_test_pred
-
-    fold_train_ensemble = (knn_weight * fold_train_predictions['KNN'] +
-                           svr_weight * fold_train_predictions['SVR'] +
-                           rfr_weight * fold_train_predictions['RandomForest'] +
-                           et_weight * fold_train_predictions['ExtraTrees'] +
-                           gp_weight * fold_train_predictions['GaussianProcess'])
-
-    fold_test_ensemble = (knn_weight * fold_test_predictions['KNN'] +
-                          svr_weight * fold_test_predictions['SVR'] +
-                          rfr_weight * fold_test_predictions['RandomForest'] +
-                          et_weight * fold_test_predictions['ExtraTrees'] +
-                          gp_weight * fold_test_predictions['GaussianProcess'])
-
-    y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-    y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
+# members with a zero weight are neither fitted nor predicted
+ensemble_weights = prune_weights({'KNN': knn_weight, 'SVR': svr_weight, 'RandomForest': rfr_weight,
+                                  'ExtraTrees': et_weight, 'GaussianProcess': gp_weight})
+oof = compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf,
+                              model_names=list(ensemble_weights), n_jobs=-1, cache=fold_cache,
+                              share_scaling=True)
+y_train_pred_ensemble, y_test_pred_ensemble = oof.blend(ensemble_weights)
 
 train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
 train_r2 = r2_score(y_train, y_train_pred_ensemble)
@@ -264,49 +268,21 @@ plot_data = pd.DataFrame({
 
 plot_data.to_csv('A.csv', index=False)
 
+# per-fold validation predictions come straight from the cached out-of-fold blend
 train_data = []
-test_data = []
-
-for train_idx, valid_idx in kf.split(X_train):
-    X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-    y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-    fold_valid_predictions = np.zeros(len(y_valid_fold))
-    fold_test_predictions = np.zeros(len(y_test))
-
-    for model_name, model in model_definitions.items():
-        model.fit(X_train_fold, y_train_fold)
-
-        y_valid_pred = model.predict(X_valid_fold)
-        y_test_pred_fold = model.predict(X_test)
-
-        if model_name == 'SVR':
-            fold_valid_predictions += svr_weight * y_valid_pred
-            fold_test_predictions += svr_weight * y_test_pred_fold
-        elif model_name == 'RandomForest':
-            fold_valid_predictions += rfr_weight * y_valid_pred
-            fold_test_predictions += rfr_weight * y_test_pred_fold
-        elif model_name == 'ExtraTrees':
-            fold_valid_predictions += et_weight * y_valid_pred
-            fold_test_predictions += et_weight * y_test_pred_fold
-        elif model_name == 'GaussianProcess':
-            fold_valid_predictions += gp_weight * y_valid_pred
-            fold_test_predictions += gp_weight * y_test_pred_fold
-        elif model_name == 'KNN':
-            fold_valid_predictions += knn_weight * y_valid_pred
-            fold_test_predictions += knn_weight * y_test_pred_fold
-
+for train_idx, valid_idx in oof.folds:
+    X_valid_fold = X_train.iloc[valid_idx]
     train_data.append(pd.DataFrame({
         **{col: X_valid_fold[col].values for col in X_valid_fold.columns},
-        'Actual': y_valid_fold.values,
-        'Prediction': fold_valid_predictions
+        'Actual': y_train.iloc[valid_idx].values,
+        'Prediction': y_train_pred_ensemble[valid_idx]
     }))
 
-    test_data.append(pd.DataFrame({
-        **{col: X_test[col].values for col in X_test.columns},
-        'Actual': y_test.values,
-        'Prediction': fold_test_predictions
-    }))
+test_data = [pd.DataFrame({
+    **{col: X_test[col].values for col in X_test.columns},
+    'Actual': y_test.values,
+    'Prediction': y_test_pred_ensemble
+})]
 
 train_df = pd.concat(train_data, ignore_index=True)
 test_df = pd.concat(test_data, ignore_index=True)
@@ -358,6 +334,7 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.ensemble import ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.inspection import PartialDependenceDisplay
+from ensemble_cv import fit_model, prune_weights
 
 X_train, X_test, y_train, y_test = train_test_split(X, ya, test_size=0.2, random_state=42)
 
@@ -388,18 +365,16 @@ model_definitions = {
 
 optimal_weights = [0.5, 0.0000, 0.5, 0.0000, 0.0000]
 model_names = list(model_definitions.keys())
-weights = dict(zip(model_names, optimal_weights))
+weights = prune_weights(dict(zip(model_names, optimal_weights)))
 
 ensemble_importances = np.zeros(X.shape[1])
 
 for model_name, weight in weights.items():
-    if weight > 0:
-        model = model_definitions[model_name]
-        model.fit(X_train, y_train)
+    model = fit_model(model_definitions[model_name], X_train, y_train, cache=fold_cache)
 
-        if hasattr(model.named_steps['model'], 'feature_importances_'):
-            model_importances = model.named_steps['model'].feature_importances_
-            ensemble_importances += weight * model_importances
+    if hasattr(model.named_steps['model'], 'feature_importances_'):
+        model_importances = model.named_steps['model'].feature_importances_
+        ensemble_importances += weight * model_importances
 
 ensemble_importances /= sum(weights.values())
 
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""One CPU budget shared by search-, estimator- and BLAS-level parallelism.
+
+BayesSearchCV(n_jobs=-1) starts one worker per core while a forest with
+n_jobs > 1 or the BLAS calls inside the GP/SVR start their own threads in
+every worker, so a tuning run can ask for cores x cores threads. CPUBudget
+splits a fixed number of cores instead: the search gets as many workers as
+it has fits to run at once (n_points x CV splits), and the cores left per
+worker go to the estimator's own n_jobs if it has one, otherwise to the BLAS
+thread pools (loky's inner_max_num_threads in the workers, threadpoolctl in
+this process).
+
+How many fits a search runs at once depends on the search: n_points
+configurations x CV splits for BayesSearchCV, every candidate x split for
+GridSearchCV/RandomizedSearchCV, and whatever its tasks_per_round method says
+for the searches that have one (multi_fidelity.HyperbandSearchCV,
+optuna_tuning.OptunaSearchCV). fit_search also takes it as an argument.
+The CV phase runs under that allocation. The final refit is a single fit and
+runs afterwards with every core given to the estimator.
+
+Every fit_search call is recorded. report() lists the allocation, the wall
+time of the CV phase and of the refit, and the worker utilization, i.e. the
+busy fit/score seconds from cv_results_ over the worker seconds that were
+reserved.
+"""
+
+import os
+import time
+from contextlib import ExitStack
+
+import pandas as pd
+from joblib import parallel_config
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, check_cv
+from threadpoolctl import threadpool_limits
+
+
+# n_jobs parameters of an estimator or of the steps of a pipeline
+def _n_jobs_params(model):
+    return [name for name in model.get_params(deep=True) if name == 'n_jobs' or name.endswith('__n_jobs')]
+
+
+# fits the search can run at once
+def _tasks_per_round(search, n_splits):
+    if hasattr(search, 'tasks_per_round'):
+        return search.tasks_per_round(n_splits)
+    if hasattr(search, 'n_points'):
+        return search.n_points * n_splits
+    if hasattr(search, 'param_grid'):
+        return len(ParameterGrid(search.param_grid)) * n_splits
+    if hasattr(search, 'n_iter'):
+        return search.n_iter * n_splits
+    return n_splits
+
+
+class CPUBudget:
+
+    def __init__(self, n_cpus=None):
+        self.n_cpus = n_cpus or os.cpu_count() or 1
+        self.runs = []
+
+    # {'search_jobs', 'estimator_jobs', 'blas_threads'} for a search that runs tasks_per_round fits at once
+    def allocate(self, model, tasks_per_round):
+        search_jobs = max(1, min(self.n_cpus, tasks_per_round))
+        threads_per_worker = max(1, self.n_cpus // search_jobs)
+        estimator_jobs = threads_per_worker if _n_jobs_params(model) else 1
+        return {
+            'search_jobs': search_jobs,
+            'estimator_jobs': estimator_jobs,
+            'blas_threads': 1 if estimator_jobs > 1 else threads_per_worker
+        }
+
+    # fits a single-metric search (BayesSearchCV, GridSearchCV, RandomizedSearchCV, HyperbandSearchCV,
+    # OptunaSearchCV) with its n_jobs, the estimator's n_jobs and the BLAS threads set from the budget, then
+    # refits the best configuration on all cores, and records the run under name
+    def fit_search(self, name, search, X, y, tasks_per_round=None, **fit_params):
+        n_splits = check_cv(search.cv).get_n_splits(X, y)
+        if tasks_per_round is None:
+            tasks_per_round = _tasks_per_round(search, n_splits)
+        allocation = self.allocate(search.estimator, tasks_per_round)
+        search.set_params(n_jobs=allocation['search_jobs'])
+        search.estimator.set_params(**{param: allocation['estimator_jobs']
+                                       for param in _n_jobs_params(search.estimator)})
+
+        refit = search.refit
+        start = time.perf_counter()
+        with ExitStack() as limits:
+            limits.enter_context(threadpool_limits(limits=allocation['blas_threads']))
+            # only for a process pool: an explicit backend would also override the forests' thread pools
+            if allocation['search_jobs'] > 1:
+                limits.enter_context(parallel_config(backend='loky',
+                                                     inner_max_num_threads=allocation['blas_threads']))
+            search.set_params(refit=False)
+            try:
+                search.fit(X, y, **fit_params)
+            finally:
+                search.set_params(refit=refit)
+        wall_time = time.perf_counter() - start
+
+        refit_time = 0.0
+        if refit:
+            # a clone, so search.estimator keeps the parameters the trials ran with
+            best_estimator = clone(search.estimator).set_params(**search.best_params_)
+            n_jobs_params = _n_jobs_params(best_estimator)
+            best_estimator.set_params(**{param: self.n_cpus for param in n_jobs_params})
+            refit_start = time.perf_counter()
+            with threadpool_limits(limits=1 if n_jobs_params else self.n_cpus):
+                search.best_estimator_ = best_estimator.fit(X, y, **fit_params)
+            refit_time = search.refit_time_ = time.perf_counter() - refit_start
+
+        results = search.cv_results_
+        busy_time = float(sum(results['mean_fit_time'] + results['mean_score_time']) * n_splits)
+        reserved_cores = allocation['search_jobs'] * max(allocation['estimator_jobs'], allocation['blas_threads'])
+        self.runs.append(dict(name=name, n_cpus=self.n_cpus, tasks_per_round=tasks_per_round, **allocation,
+                              reserved_cores=reserved_cores, wall_seconds=wall_time, refit_seconds=refit_time,
+                              busy_worker_seconds=busy_time,
+                              worker_utilization=busy_time / (wall_time * allocation['search_jobs'])))
+        return search
+
+    def report(self):
+        return pd.DataFrame(self.runs).set_index('name')
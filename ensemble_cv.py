@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Out-of-fold prediction stage shared by the ensemble weight optimization scripts.
+
+The base-model predictions inside the K-fold loop do not depend on the ensemble
+weights, so they are computed once and stored as an (n_train x n_models) matrix.
+Scoring a weight vector is then a weighted sum over that matrix.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+from sklearn.tree import BaseDecisionTree
+
+
+# container for the out-of-fold (validation) and fold-averaged test predictions of every model
+class OOFPredictions:
+
+    def __init__(self, model_names, y_train, valid_predictions, test_predictions, folds, fold_models=None):
+        self.model_names = list(model_names)
+        self.y_train = np.asarray(y_train, dtype=float)
+        self.valid_predictions = valid_predictions
+        self.test_predictions = test_predictions
+        self.folds = folds
+        self.fold_models = fold_models
+        self._gram = None
+
+    def column(self, model_name):
+        return self.model_names.index(model_name)
+
+    def _weight_vector(self, weights):
+        if isinstance(weights, dict):
+            weights = [weights.get(name, 0.0) for name in self.model_names]
+        weights = np.asarray(weights, dtype=float)
+        if weights.shape != (len(self.model_names),):
+            raise ValueError(f"Expected {len(self.model_names)} weights, got shape {weights.shape}")
+        return weights
+
+    # weighted blend of the stored predictions, same result as the per-fold weighted sums in the scripts
+    def blend(self, weights):
+        weights = self._weight_vector(weights)
+        return self.valid_predictions @ weights, self.test_predictions @ weights
+
+    def rmse(self, weights):
+        weights = self._weight_vector(weights)
+        residuals = self.y_train - self.valid_predictions @ weights
+        return float(np.sqrt(np.mean(residuals ** 2)))
+
+    # RMSE of k weight vectors (k x n_models) at once, ||y - P w||^2 is expanded through the
+    # Gram matrix P'P so scoring a batch is one matmul whose cost does not grow with n_train
+    def rmse_batch(self, weights_batch, normalize=False):
+        weights_batch = np.atleast_2d(np.asarray(weights_batch, dtype=float))
+        if weights_batch.shape[1] != len(self.model_names):
+            raise ValueError(f"Expected {len(self.model_names)} columns, got shape {weights_batch.shape}")
+        if normalize:
+            weights_batch = weights_batch / weights_batch.sum(axis=1, keepdims=True)
+        if self._gram is None:
+            self._gram = self.valid_predictions.T @ self.valid_predictions
+            self._cross = self.valid_predictions.T @ self.y_train
+            self._yy = self.y_train @ self.y_train
+
+        sse = (self._yy - 2.0 * weights_batch @ self._cross
+               + np.einsum('ij,ij->i', weights_batch @ self._gram, weights_batch))
+        return np.sqrt(np.clip(sse, 0.0, None) / len(self.y_train))
+
+
+def _take_rows(data, idx):
+    return data.iloc[idx] if hasattr(data, 'iloc') else data[idx]
+
+
+# (scaler step, model step, estimator) of a plain Pipeline([('scaler', StandardScaler()), ('model', estimator)]),
+# None for every other model
+def _split_scaler(model):
+    if type(model) is not Pipeline or len(model.steps) != 2:
+        return None
+    (scaler_name, scaler), (model_name, estimator) = model.steps
+    if not isinstance(scaler, StandardScaler) or scaler.get_params() != StandardScaler().get_params():
+        return None
+    return scaler_name, model_name, estimator
+
+
+# trees and forests only compare a feature against thresholds, so standardizing does not change their splits
+def _is_scale_invariant(estimator):
+    return isinstance(estimator, BaseDecisionTree) or isinstance(getattr(estimator, 'estimator', None),
+                                                                    BaseDecisionTree)
+
+
+# kernel stores (gp_warm_start.WarmStartGaussianProcessRegressor) a model would read but that do not exist yet
+def _missing_kernel_stores(model):
+    return [path for name, path in model.get_params(deep=True).items()
+            if (name == 'kernel_store' or name.endswith('__kernel_store')) and path and not os.path.exists(path)]
+
+
+def _resolve_n_jobs(n_jobs):
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def _fit_and_predict(model, X_fit, y_fit, X_valid, X_test, keep_model):
+    model.fit(X_fit, y_fit)
+    return model.predict(X_valid), model.predict(X_test), model if keep_model else None
+
+
+# models exposing cv_predict (e.g. gp_cv.ClosedFormCVPipeline) return the (valid, test, model) triple
+# of every fold from a single fit
+def _cv_predict(model, X_train, y_train, X_test, folds):
+    return model.cv_predict(X_train, y_train, X_test, folds)
+
+
+# runs {key: (function, *args)} in-process or fanned out over a process pool, every task owns its own
+# estimator so nothing is shared between workers
+def run_fit_tasks(tasks, n_jobs=1):
+    n_workers = min(_resolve_n_jobs(n_jobs), len(tasks))
+    if n_workers <= 1:
+        return {key: task[0](*task[1:]) for key, task in tasks.items()}
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {key: executor.submit(*task) for key, task in tasks.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+# fits a clone of model on (X, y), reusing a cached fit when the data and parameters are unchanged
+def fit_model(model, X, y, cache=None):
+    if cache is not None:
+        key = cache.key(model, X, y)
+        fitted = cache.get(key)
+        if fitted is not None:
+            return fitted
+    fitted = clone(model).fit(X, y)
+    if cache is not None:
+        cache.put(key, fitted)
+    return fitted
+
+
+# fits every model on every fold exactly once and collects the predictions,
+# n_jobs > 1 (or -1 for all cores) runs the fold x model fits on a process pool and
+# cache (a fold_cache.FoldCache) skips every fit whose data and parameters were seen before
+def compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf, model_names=None, keep_models=False,
+                            n_jobs=1, cache=None, share_scaling=False, dtype=np.float64, raw_tree_features=False):
+    return compute_oof_predictions_multi({None: model_definitions}, X_train, {None: y_train}, X_test, kf,
+                                         model_names=model_names, keep_models=keep_models, n_jobs=n_jobs,
+                                         cache=cache, share_scaling=share_scaling, dtype=dtype,
+                                         raw_tree_features=raw_tree_features)[None]
+
+
+# out-of-fold predictions for several targets sharing X, the train/test split and the folds.
+# The folds are built and sliced once and every target x fold x model fit is scheduled in a single
+# task batch, so the combined workload can saturate the pool. Returns {target: OOFPredictions}.
+# share_scaling=True standardizes every fold once and hands the same contiguous arrays (of the given dtype)
+# to every StandardScaler pipeline, with the same predictions as the per-pipeline fits. raw_tree_features=True
+# also skips the scaling of the scale-invariant tree members by giving them the unscaled rows, which changes
+# their results: integer compositions often lie exactly on a split midpoint, and rounding then sends them to
+# the other side (RandomForest moved 2-9 of ~20 validation rows per fold on HTSMA_Data).
+# The kept fold models are reassembled into pipelines around the shared fold scaler, so they still predict
+# on raw features.
+def compute_oof_predictions_multi(model_definitions_by_target, X_train, y_train_by_target, X_test, kf,
+                                  model_names=None, keep_models=False, n_jobs=1, cache=None, share_scaling=False,
+                                  dtype=np.float64, raw_tree_features=False):
+    folds = [(np.asarray(train_idx), np.asarray(valid_idx)) for train_idx, valid_idx in kf.split(X_train)]
+    X_folds = [(_take_rows(X_train, train_idx), _take_rows(X_train, valid_idx)) for train_idx, valid_idx in folds]
+    if share_scaling:
+        fold_scalers = [StandardScaler().fit(X_fit) for X_fit, _ in X_folds]
+        raw_arrays = [tuple(np.ascontiguousarray(part, dtype=dtype) for part in (X_fit, X_valid, X_test))
+                      for X_fit, X_valid in X_folds]
+        scaled_arrays = [tuple(np.ascontiguousarray(scaler.transform(part), dtype=dtype)
+                               for part in (X_fit, X_valid, X_test))
+                         for scaler, (X_fit, X_valid) in zip(fold_scalers, X_folds)]
+    names_by_target = {target: list(model_names or model_definitions)
+                       for target, model_definitions in model_definitions_by_target.items()}
+
+    tasks, cache_keys, results, split_models = {}, {}, {}, {}
+
+    def add_task(task_key, task, *key_data):
+        if cache is not None:
+            key = cache.key(task[1], *key_data)
+            cached = cache.get(key)
+            if cached is not None:
+                results[task_key] = cached
+                return
+            cache_keys[task_key] = key
+        tasks[task_key] = task
+
+    for target, model_definitions in model_definitions_by_target.items():
+        y_train = y_train_by_target[target]
+        for model_name in names_by_target[target]:
+            # the single-fit path has no per-fold models, so keep_models falls back to the fold loop
+            if hasattr(model_definitions[model_name], 'cv_predict') and not keep_models:
+                model = clone(model_definitions[model_name])
+                add_task((target, None, model_name), (_cv_predict, model, X_train, y_train, X_test, folds),
+                         X_train, y_train, X_test, folds)
+                continue
+            split = _split_scaler(model_definitions[model_name]) if share_scaling else None
+            if split is not None:
+                split_models[target, model_name] = split[:2] + (raw_tree_features and _is_scale_invariant(split[2]),)
+                y_array = np.asarray(y_train, dtype=float)
+            for fold, (train_idx, valid_idx) in enumerate(folds):
+                if split is not None:
+                    model = clone(split[2])
+                    arrays = raw_arrays[fold] if split_models[target, model_name][2] else scaled_arrays[fold]
+                    X_train_fold, X_valid_fold, X_test_fold = arrays
+                    y_train_fold = y_array[train_idx]
+                else:
+                    model = clone(model_definitions[model_name])
+                    (X_train_fold, X_valid_fold), X_test_fold = X_folds[fold], X_test
+                    y_train_fold = _take_rows(y_train, train_idx)
+                # cached entries always store the fitted model so later callers can ask for it
+                add_task((target, fold, model_name),
+                         (_fit_and_predict, model, X_train_fold, y_train_fold, X_valid_fold, X_test_fold,
+                          keep_models or cache is not None),
+                         X_train_fold, y_train_fold, X_valid_fold, X_test_fold)
+
+    # on a process pool every fold would start cold and race to write the kernel store, so the first fold
+    # of each warm-started model runs here first and seeds the store the other folds start from
+    seeded = {}
+    if _resolve_n_jobs(n_jobs) > 1:
+        for task_key in [task_key for task_key in tasks if task_key[1] == 0
+                         and _missing_kernel_stores(tasks[task_key][1])]:
+            task = tasks.pop(task_key)
+            seeded[task_key] = task[0](*task[1:])
+    computed = run_fit_tasks(tasks, n_jobs=n_jobs)
+    computed.update(seeded)
+    for task_key, result in computed.items():
+        if cache is not None:
+            cache.put(cache_keys[task_key], result)
+    results.update(computed)
+    for (target, fold, model_name), result in list(results.items()):
+        if fold is None:
+            for fold, fold_result in enumerate(result):
+                results[target, fold, model_name] = fold_result
+
+    oof_by_target = {}
+    for target, model_names_t in names_by_target.items():
+        y_train = y_train_by_target[target]
+        valid_predictions = np.full((len(y_train), len(model_names_t)), np.nan)
+        test_predictions = np.zeros((len(X_test), len(model_names_t)))
+        fold_models = [{} for _ in folds]
+        for fold, (train_idx, valid_idx) in enumerate(folds):
+            for column, model_name in enumerate(model_names_t):
+                y_valid_pred, y_test_pred, model = results[target, fold, model_name]
+                if keep_models and (target, model_name) in split_models:
+                    scaler_name, step_name, scale_invariant = split_models[target, model_name]
+                    scaler = (FunctionTransformer(np.asarray).fit(X_folds[fold][0]) if scale_invariant
+                              else fold_scalers[fold])
+                    model = Pipeline([(scaler_name, scaler), (step_name, model)])
+                valid_predictions[valid_idx, column] = y_valid_pred
+                test_predictions[:, column] += y_test_pred / len(folds)
+                fold_models[fold][model_name] = model
+        oof_by_target[target] = OOFPredictions(model_names_t, y_train, valid_predictions, test_predictions, folds,
+                                               fold_models if keep_models else None)
+    return oof_by_target
+
+
+# drops members whose weight is below threshold and rescales the rest to the original total,
+# so downstream sections only fit and predict the models that actually contribute
+def prune_weights(weights, threshold=1e-3):
+    active = {name: weight for name, weight in weights.items() if weight >= threshold}
+    if not active:
+        raise ValueError(f"Every ensemble weight is below the pruning threshold {threshold}")
+    scale = sum(weights.values()) / sum(active.values())
+    return {name: weight * scale for name, weight in active.items()}
+
+
+# weighted blend of already fitted members, only the members listed in weights are used
+class WeightedEnsemble:
+
+    def __init__(self, models, weights):
+        self.weights = dict(weights)
+        self.models = {name: models[name] for name in self.weights}
+
+    def predict(self, X):
+        prediction = np.zeros(len(X))
+        for model_name, weight in self.weights.items():
+            prediction += weight * self.models[model_name].predict(X)
+        return prediction
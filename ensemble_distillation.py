@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Distillation of the weighted ensemble into one surrogate model for composition screens.
+
+A composition screen only needs the blended output of the ensemble, not its
+members. distill_ensemble labels a dense set of synthetic compositions with the
+ensemble and fits a single compact regressor on them. The deviation from the
+ensemble is then measured on a second, independent set of compositions.
+sample_compositions draws those sets uniformly from the same element systems
+the screening grids cover.
+
+The surrogate only reproduces the ensemble inside the sampled systems. Its
+deviation report (RMSE, largest difference, both relative to the spread of the
+ensemble output) should be checked before it replaces the ensemble in a screen.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+
+# n_samples compositions spread evenly over the systems (lists of element columns), every system's elements
+# drawn uniformly from the simplex summing to total, all other columns zero
+def sample_compositions(columns, systems, n_samples, total=100, random_state=None):
+    rng = np.random.default_rng(random_state)
+    parts = []
+    for system, size in zip(systems, np.diff(np.linspace(0, n_samples, len(systems) + 1).astype(int))):
+        part = pd.DataFrame(0.0, index=np.arange(size), columns=columns)
+        part[list(system)] = rng.dirichlet(np.ones(len(system)), size) * total
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def default_surrogate():
+    return Pipeline([
+        ('scaler', StandardScaler()),
+        ('model', MLPRegressor(hidden_layer_sizes=(64, 64), max_iter=500, early_stopping=True,
+                               n_iter_no_change=20, random_state=42))
+    ])
+
+
+# fits a clone of surrogate (default: small MLP) on the ensemble's predictions for X_synthetic and
+# reports its deviation from the ensemble on X_validation, returns (fitted surrogate, report)
+def distill_ensemble(ensemble, X_synthetic, X_validation, surrogate=None, verbose=True):
+    surrogate = clone(surrogate if surrogate is not None else default_surrogate())
+    surrogate.fit(X_synthetic, ensemble.predict(X_synthetic))
+
+    start = time.perf_counter()
+    y_ensemble = ensemble.predict(X_validation)
+    ensemble_time = time.perf_counter() - start
+    start = time.perf_counter()
+    y_surrogate = surrogate.predict(X_validation)
+    surrogate_time = time.perf_counter() - start
+
+    deviation = y_surrogate - y_ensemble
+    report = {
+        'rmse_deviation': float(np.sqrt(np.mean(deviation ** 2))),
+        'max_abs_deviation': float(np.max(np.abs(deviation))),
+        'relative_rmse_deviation': float(np.sqrt(np.mean(deviation ** 2)) / np.std(y_ensemble)),
+        'ensemble_seconds': ensemble_time,
+        'surrogate_seconds': surrogate_time,
+        'speedup': ensemble_time / surrogate_time
+    }
+    if verbose:
+        print(f"Surrogate vs ensemble on {len(y_ensemble)} compositions: RMSE {report['rmse_deviation']:.4f} "
+              f"({report['relative_rmse_deviation']:.2%} of the ensemble spread), "
+              f"max deviation {report['max_abs_deviation']:.4f}, {report['speedup']:.1f}x faster")
+    return surrogate, report
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed on-disk cache for fitted fold models and their predictions.
+
+Entries are keyed by a hash of the estimator parameters and of the exact data
+passed to fit/predict (input columns, target column and the rows selected by
+the fold indices), so re-running a section with unchanged inputs loads the
+stored result instead of refitting.
+"""
+
+import os
+
+import joblib
+from sklearn.base import BaseEstimator
+
+
+# estimator class and parameters, with nested estimators reduced to their class so the
+# fingerprint does not depend on object identity. A kernel_store (gp_warm_start) seeds the fit from
+# its file, so the file's current contents are part of the fingerprint
+def estimator_fingerprint(model):
+    params = []
+    for name, value in sorted(model.get_params(deep=True).items()):
+        if name.split('__')[-1] == 'kernel_store' and value is not None:
+            value = (repr(value), joblib.hash(joblib.load(value)) if os.path.exists(value) else None)
+        elif isinstance(value, BaseEstimator):
+            value = f"{type(value).__module__}.{type(value).__name__}"
+        elif name == 'steps':
+            value = [(step_name, f"{type(step).__module__}.{type(step).__name__}") for step_name, step in value]
+        else:
+            value = repr(value)
+        params.append((name, value))
+    return f"{type(model).__module__}.{type(model).__name__}", params
+
+
+class FoldCache:
+
+    def __init__(self, directory='fold_cache'):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, model, *data):
+        return joblib.hash((estimator_fingerprint(model), data))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.joblib")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return joblib.load(path)
+
+    def put(self, key, value):
+        # write to a temporary file first so a crash never leaves a truncated entry behind
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.joblib'):
+                os.remove(os.path.join(self.directory, filename))
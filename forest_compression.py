@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Post-training compression of the fitted forests.
+
+The trees of a forest with a fixed random_state are grown one after the other,
+so its first m trees are exactly the forest fitted with n_estimators=m. One set
+of K-fold fits therefore gives the out-of-fold RMSE of every forest size at
+once (cumulative sums over the per-tree validation predictions), and
+select_trees picks the fewest leading trees from which on the OOF RMSE stays
+within a relative tolerance of the full forest. A matching RMSE alone does not
+make a small prefix a stand-in for the forest, so every OOF prediction also has
+to stay within max_deviation (a fraction of the full forest's OOF RMSE) of the
+full forest's one, and at least min_trees are kept. prune_forest cuts a fitted
+forest down to that size without refitting.
+
+The pruned forest can further be stored as a float32 FlatForest
+(forest_engine.FlatForest.quantized). compression_report writes every variant
+to disk and reports its size, load time and predict latency.
+"""
+
+import os
+import tempfile
+import time
+from copy import deepcopy
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from ensemble_cv import compute_oof_predictions
+from forest_engine import FlatForest
+
+
+def _split_forest(model):
+    if isinstance(model, Pipeline):
+        return model[:-1], model.steps[-1][1]
+    return None, model
+
+
+# per-tree out-of-fold predictions of a forest (pipeline), shape (n_trees, n_train)
+def tree_oof_predictions(model, X_train, y_train, kf, cache=None):
+    oof = compute_oof_predictions({'forest': model}, X_train, y_train, X_train[:1], kf, keep_models=True,
+                                  cache=cache)
+    tree_predictions = None
+    for fold_models, (_, valid_idx) in zip(oof.fold_models, oof.folds):
+        preprocess, forest = _split_forest(fold_models['forest'])
+        X_valid = X_train.iloc[valid_idx] if hasattr(X_train, 'iloc') else X_train[valid_idx]
+        if preprocess is not None:
+            X_valid = preprocess.transform(X_valid)
+        X_valid = np.asarray(X_valid, dtype=np.float32)
+        if tree_predictions is None:
+            tree_predictions = np.empty((len(forest.estimators_), len(oof.y_train)))
+        for tree, estimator in enumerate(forest.estimators_):
+            tree_predictions[tree, valid_idx] = estimator.predict(X_valid)
+    return tree_predictions
+
+
+# fewest leading trees (at least min_trees) whose OOF RMSE, and the one of every larger prefix, is at most
+# (1 + tolerance) times the one of the full forest and whose OOF predictions all stay within
+# max_deviation x the full forest's OOF RMSE of the full forest's predictions
+def select_trees(model, X_train, y_train, kf, tolerance=0.01, max_deviation=0.1, min_trees=10, cache=None,
+                 verbose=True):
+    tree_predictions = tree_oof_predictions(model, X_train, y_train, kf, cache=cache)
+    n_trees = len(tree_predictions)
+    # cumsum adds the trees in order like predict, so row m - 1 is the m-tree forest prediction
+    predictions = np.cumsum(tree_predictions, axis=0) / np.arange(1, n_trees + 1)[:, None]
+    rmse_by_size = np.sqrt(np.mean((np.asarray(y_train, dtype=float) - predictions) ** 2, axis=1))
+    deviation_by_size = np.max(np.abs(predictions - predictions[-1]), axis=1)
+    accepted = ((rmse_by_size <= rmse_by_size[-1] * (1 + tolerance))
+                & (deviation_by_size <= max_deviation * rmse_by_size[-1]))
+    accepted[:min(min_trees, n_trees) - 1] = False
+    # small forests can dip below the bounds by chance, so every size from the selected one on has to meet them
+    rejected = np.nonzero(~accepted)[0]
+    selected = int(rejected[-1]) + 2 if len(rejected) else 1
+    report = {
+        'n_trees': selected,
+        'oof_rmse': float(rmse_by_size[selected - 1]),
+        'max_deviation': float(deviation_by_size[selected - 1]),
+        'full_n_trees': n_trees,
+        'full_oof_rmse': float(rmse_by_size[-1]),
+        'oof_rmse_by_size': rmse_by_size,
+        'max_deviation_by_size': deviation_by_size
+    }
+    if verbose:
+        print(f"{selected} of {n_trees} trees keep the OOF RMSE within {tolerance:.1%} "
+              f"({report['oof_rmse']:.4f} vs {report['full_oof_rmse']:.4f}) and every OOF prediction within "
+              f"{report['max_deviation']:.4f} of the full forest")
+    return report
+
+
+# copy of a fitted forest (pipeline) that keeps its first n_trees trees
+def prune_forest(model, n_trees):
+    model = deepcopy(model)
+    _, forest = _split_forest(model)
+    if not 1 <= n_trees <= len(forest.estimators_):
+        raise ValueError(f"n_trees must be between 1 and {len(forest.estimators_)}, got {n_trees}")
+    forest.estimators_ = forest.estimators_[:n_trees]
+    forest.n_estimators = n_trees
+    # the out-of-bag estimates belong to the full forest
+    for attribute in ('oob_score_', 'oob_prediction_'):
+        if hasattr(forest, attribute):
+            delattr(forest, attribute)
+    return model
+
+
+def _save_artifact(model, path):
+    if isinstance(model, FlatForest):
+        path = f"{path}.npz"
+        model.save(path)
+    else:
+        path = f"{path}.joblib"
+        joblib.dump(model, path)
+    return path
+
+
+def _load_artifact(model, path):
+    if isinstance(model, FlatForest):
+        return FlatForest.load(path, preprocess=model.preprocess)
+    return joblib.load(path)
+
+
+# size on disk, load time and predict latency of {name: forest, forest pipeline or FlatForest},
+# with the largest prediction difference against the first entry
+def compression_report(models, X, directory=None, repeats=5):
+    rows, reference = {}, None
+    with tempfile.TemporaryDirectory() as tmp_directory:
+        for name, model in models.items():
+            path = _save_artifact(model, os.path.join(directory or tmp_directory, name.replace(' ', '_')))
+            start = time.perf_counter()
+            loaded = _load_artifact(model, path)
+            load_time = time.perf_counter() - start
+            latencies = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                prediction = loaded.predict(X)
+                latencies.append(time.perf_counter() - start)
+            if reference is None:
+                reference = prediction
+            rows[name] = {
+                'n_trees': model.n_trees if isinstance(model, FlatForest) else
+                len(_split_forest(model)[1].estimators_),
+                'size_mb': os.path.getsize(path) / 2 ** 20,
+                'load_ms': load_time * 1000,
+                'predict_ms': np.median(latencies) * 1000,
+                'max_abs_difference': float(np.max(np.abs(prediction - reference)))
+            }
+    return pd.DataFrame.from_dict(rows, orient='index')
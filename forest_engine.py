@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Flat-array inference engine for fitted RandomForest/ExtraTrees regressors.
+
+Every tree of a fitted forest is packed into one set of contiguous node arrays
+(feature, threshold, left/right child, leaf value) with the children offset to
+global node ids; that is the exported format.
+
+Batch prediction compiles the node arrays into bitvector tables (QuickScorer):
+the leaves of each tree are numbered left to right, a split that sends a row to
+the right removes the leaves of its left subtree, and the row ends in the
+leftmost leaf that survives all splits. Sorting the split thresholds of each
+feature and AND-ing the masks cumulatively turns the whole forest into one
+searchsorted plus one table gather per feature, so a batch of rows is scored
+for all trees at once without walking the trees. The leftmost leaf is found
+with a de Bruijn multiply, and the masks use 32-bit words when every tree has
+at most 32 leaves. Forests whose tables would exceed max_table_bytes fall back
+to a level-by-level traversal of the node arrays.
+
+On the scripts' forests (at most 64 leaves per tree, one mask word) the tables
+score 200k compositions about 1.6-1.8x faster than predict on one core. With
+more leaves every extra word costs another gather and the tables are no faster
+than predict, so compile_forests keeps those forests on predict.
+
+Predictions agree bit for bit with predict: rows are rounded to float32 before
+the threshold comparisons as sklearn does, and the per-tree leaf values are
+accumulated in tree order before the division by the number of trees.
+test_forest_engine.py checks this on the scripts' forests, their float32
+copies and a forest whose masks need several words.
+"""
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+
+TREE_LEAF = -1
+
+
+# word dtype, de Bruijn constant and bit-position lookup of 32- or 64-bit leaf masks: the top log2(bits)
+# bits of (2^k * de_bruijn) are distinct for every k, so they identify the single set bit
+def _word_format(bits):
+    dtype, de_bruijn = (np.uint32, 0x077CB531) if bits == 32 else (np.uint64, 0x03F79D71B4CB0A89)
+    shift = bits - bits.bit_length() + 1
+    bit_position = np.empty(bits, dtype=np.intp)
+    bit_position[[((de_bruijn << k) & ((1 << bits) - 1)) >> shift for k in range(bits)]] = np.arange(bits)
+    return dtype, dtype(de_bruijn), dtype(shift), bit_position
+
+
+WORD_FORMATS = {bits: _word_format(bits) for bits in (32, 64)}
+
+
+class FlatForest:
+
+    def __init__(self, feature, threshold, children_left, children_right, value, roots, preprocess=None,
+                 max_table_bytes=512 * 2 ** 20):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.roots = roots
+        self.preprocess = preprocess
+        self.max_table_bytes = max_table_bytes
+        self._tables = None
+
+    # packs a fitted forest, or a Pipeline ending in one (the preceding steps are kept as preprocessing)
+    @classmethod
+    def from_model(cls, model):
+        preprocess = None
+        if isinstance(model, Pipeline):
+            preprocess = model[:-1] if len(model.steps) > 1 else None
+            model = model.steps[-1][1]
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("FlatForest only supports single-output regressors")
+
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == TREE_LEAF
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            left.append(np.where(is_leaf, TREE_LEAF, tree.children_left + offset))
+            right.append(np.where(is_leaf, TREE_LEAF, tree.children_right + offset))
+            value.append(tree.value[:, 0, 0])
+            offset += tree.node_count
+
+        return cls(np.ascontiguousarray(np.concatenate(feature), dtype=np.intp),
+                   np.ascontiguousarray(np.concatenate(threshold), dtype=np.float64),
+                   np.ascontiguousarray(np.concatenate(left), dtype=np.intp),
+                   np.ascontiguousarray(np.concatenate(right), dtype=np.intp),
+                   np.ascontiguousarray(np.concatenate(value), dtype=np.float64),
+                   np.asarray(roots, dtype=np.intp), preprocess)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    # words per tree in the bitvector masks, None when the forest falls back to the traversal
+    @property
+    def table_words(self):
+        tables = self._compile()
+        return tables[1][0].shape[2] if tables else None
+
+    # leaf node id reached by every (row, tree) pair, shape (n_rows, n_trees)
+    def apply(self, X):
+        X = np.asarray(X)
+        n_rows = X.shape[0]
+        leaves = np.empty((n_rows, self.n_trees), dtype=np.intp)
+        rows = np.repeat(np.arange(n_rows), self.n_trees)
+        cursor_ids = np.arange(n_rows * self.n_trees)
+        nodes = np.tile(self.roots, n_rows)
+        flat_leaves = leaves.reshape(-1)
+        while len(nodes):
+            left = self.children_left[nodes]
+            done = left == TREE_LEAF
+            flat_leaves[cursor_ids[done]] = nodes[done]
+            active = ~done
+            rows, cursor_ids, nodes, left = rows[active], cursor_ids[active], nodes[active], left[active]
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, left, self.children_right[nodes])
+        return leaves
+
+    # leaves of the tree below root in left-to-right order and, for every split, the [start, stop)
+    # range of leaf positions in its left subtree
+    def _leaf_ranges(self, root):
+        leaves, left_ranges, starts = [], {}, {}
+        stack = [(root, False)]
+        while stack:
+            node, left_done = stack.pop()
+            if left_done:
+                left_ranges[node] = (starts[node], len(leaves))
+            elif self.children_left[node] == TREE_LEAF:
+                leaves.append(node)
+            else:
+                starts[node] = len(leaves)
+                stack.extend([(self.children_right[node], False), (node, True), (self.children_left[node], False)])
+        return leaves, left_ranges
+
+    def _compile(self):
+        if self._tables is not None:
+            return self._tables
+        trees = [self._leaf_ranges(root) for root in self.roots]
+        n_leaves = max(len(leaves) for leaves, _ in trees)
+        # half-width words move half the bytes when every tree has at most 32 leaves
+        bits = 32 if n_leaves <= 32 else 64
+        dtype = WORD_FORMATS[bits][0]
+        n_words = (n_leaves + bits - 1) // bits
+        n_features = int(self.feature.max()) + 1
+        n_splits = sum(len(left_ranges) for _, left_ranges in trees)
+        if (n_splits + n_features) * self.n_trees * n_words * bits // 8 > self.max_table_bytes:
+            self._tables = False
+            return self._tables
+
+        leaf_values = np.zeros((self.n_trees, n_words * bits))
+        split_tree, split_node, split_mask = [], [], []
+        for tree, (leaves, left_ranges) in enumerate(trees):
+            leaf_values[tree, :len(leaves)] = self.value[leaves]
+            for node, (start, stop) in left_ranges.items():
+                removed = (1 << stop) - (1 << start)
+                split_tree.append(tree)
+                split_node.append(node)
+                split_mask.append([~(removed >> (bits * word)) & ((1 << bits) - 1) for word in range(n_words)])
+        split_tree, split_node = np.asarray(split_tree), np.asarray(split_node)
+        split_mask = np.asarray(split_mask, dtype=dtype).reshape(len(split_node), n_words)
+
+        thresholds, tables = [], []
+        for feature in range(n_features):
+            selected = np.nonzero(self.feature[split_node] == feature)[0]
+            selected = selected[np.argsort(self.threshold[split_node[selected]], kind='stable')]
+            # tables[feature][k] is the AND of the masks of the k splits with the smallest thresholds
+            table = np.empty((len(selected) + 1, self.n_trees, n_words), dtype=dtype)
+            table[0] = dtype((1 << bits) - 1)
+            for k, split in enumerate(selected):
+                table[k + 1] = table[k]
+                table[k + 1, split_tree[split]] &= split_mask[split]
+            thresholds.append(self.threshold[split_node[selected]])
+            tables.append(table)
+        # flat position of leaf 0 of every tree in leaf_values
+        tree_offsets = np.arange(self.n_trees) * leaf_values.shape[1]
+        self._tables = thresholds, tables, leaf_values.reshape(-1), tree_offsets, bits
+        return self._tables
+
+    def _predict_tables(self, X):
+        thresholds, tables, leaf_values, tree_offsets, bits = self._tables
+        _, de_bruijn, shift, bit_position = WORD_FORMATS[bits]
+        # a row goes right at every split whose threshold is strictly below its value
+        mask = tables[0][np.searchsorted(thresholds[0], X[:, 0], side='left')]
+        for feature in range(1, len(tables)):
+            mask &= tables[feature][np.searchsorted(thresholds[feature], X[:, feature], side='left')]
+        # the leftmost surviving leaf: lowest set bit (word & -word) of the first non-empty word, whose
+        # position is read off the de Bruijn product
+        leaf = None
+        for index in range(mask.shape[2] - 1, -1, -1):
+            word = mask[:, :, index]
+            position = bit_position[((word & -word) * de_bruijn) >> shift] + bits * index
+            leaf = position if leaf is None else np.where(word != 0, position, leaf)
+        return leaf_values[(leaf + tree_offsets).T]
+
+    def _predict_traversal(self, X):
+        return self.value[self.apply(X)].T
+
+    # the default batch keeps the (rows x trees) masks of a batch at about 64k words, small enough for the cache
+    def predict(self, X, batch_size=None):
+        if self.preprocess is not None:
+            X = self.preprocess.transform(X)
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        score = self._predict_tables if self._compile() else self._predict_traversal
+        batch_size = batch_size or max(1, 2 ** 16 // self.n_trees)
+        prediction = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], batch_size):
+            # accumulated tree by tree like predict; np.sum may reorder (pairwise) the additions
+            total = np.zeros(min(batch_size, X.shape[0] - start))
+            for tree_values in score(X[start:start + batch_size]):
+                total += tree_values
+            prediction[start:start + batch_size] = total / self.n_trees
+        return prediction
+
+    # float32 node values and int32 indices at about half the size: every threshold is rounded down to
+    # a float32, which sends every float32 row the same way, only the leaf values lose precision
+    def quantized(self):
+        threshold = self.threshold.astype(np.float32)
+        above = threshold > self.threshold
+        threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+        return FlatForest(self.feature.astype(np.int32), threshold, self.children_left.astype(np.int32),
+                          self.children_right.astype(np.int32), self.value.astype(np.float32),
+                          self.roots.astype(np.int32), self.preprocess, self.max_table_bytes)
+
+    def save(self, path):
+        np.savez(path, feature=self.feature, threshold=self.threshold, children_left=self.children_left,
+                 children_right=self.children_right, value=self.value, roots=self.roots)
+
+    # the preprocessing steps are not part of the array file and have to be passed back in
+    @classmethod
+    def load(cls, path, preprocess=None):
+        arrays = np.load(path)
+        return cls(arrays['feature'], arrays['threshold'], arrays['children_left'], arrays['children_right'],
+                   arrays['value'], arrays['roots'], preprocess)
+
+
+def _is_forest(model):
+    estimator = model.steps[-1][1] if isinstance(model, Pipeline) else model
+    return hasattr(estimator, 'estimators_') and hasattr(estimator.estimators_[0], 'tree_')
+
+
+# agreement check of the flat engine against the model's own predict, returns the largest difference
+def check_flat_forest(model, X, flat_forest=None):
+    if flat_forest is None:
+        flat_forest = FlatForest.from_model(model)
+    expected, actual = model.predict(X), flat_forest.predict(X)
+    if not np.array_equal(expected, actual):
+        raise AssertionError(f"FlatForest differs from predict by up to {np.max(np.abs(expected - actual))}")
+    return float(np.max(np.abs(expected - actual)))
+
+
+# {name: model} with every fitted forest (or forest pipeline) whose masks fit one word replaced by its
+# FlatForest, each one checked with check_flat_forest on X_check when given
+def compile_forests(models, X_check=None):
+    compiled = {}
+    for name, model in models.items():
+        compiled[name] = model
+        if _is_forest(model):
+            flat_forest = FlatForest.from_model(model)
+            if flat_forest.table_words == 1:
+                compiled[name] = flat_forest
+        if X_check is not None and compiled[name] is not model:
+            check_flat_forest(model, X_check, compiled[name])
+    return compiled
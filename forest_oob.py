@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Out-of-bag predictions as the validation predictions of bootstrap forests.
+
+Every tree of a bootstrap=True forest leaves about a third of the training rows
+out of its sample, so one forest fitted on all training rows already provides
+held-out predictions for every row. OOBForestPipeline hands those to
+compute_oof_predictions in place of the K fold refits. The test predictions
+come from the full-train forest instead of the average of the fold forests.
+
+The OOB prediction of a row averages roughly 37% of the trees, while the K-fold
+one uses all trees of a forest grown on 80% of the rows, so the two agree
+statistically rather than bit for bit. oob_equivalence_check quantifies the
+agreement on a given data set before the OOB mode is trusted for the weights.
+"""
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+
+from ensemble_cv import compute_oof_predictions
+
+
+# Pipeline ending in a RandomForestRegressor/ExtraTreesRegressor with bootstrap=True,
+# compute_oof_predictions uses cv_predict instead of one fit per fold
+class OOBForestPipeline(Pipeline):
+
+    def cv_predict(self, X_train, y_train, X_test, folds):
+        step_name, forest = self.steps[-1]
+        if not forest.bootstrap:
+            raise ValueError("Out-of-bag predictions need a forest with bootstrap=True")
+        self.set_params(**{f"{step_name}__oob_score": True})
+        self.fit(X_train, y_train)
+        oob_prediction = self.steps[-1][1].oob_prediction_
+        y_test_pred = self.predict(X_test)
+        return [(oob_prediction[valid_idx], y_test_pred, None) for _, valid_idx in folds]
+
+
+# compares the OOB and the K-fold validation predictions of one forest pipeline
+def oob_equivalence_check(model, X_train, y_train, kf, verbose=True):
+    steps = clone(model).steps
+    kfold = compute_oof_predictions({'forest': Pipeline(steps)}, X_train, y_train, X_train[:1], kf)
+    oob = compute_oof_predictions({'forest': OOBForestPipeline(clone(model).steps)}, X_train, y_train,
+                                  X_train[:1], kf)
+    kfold_pred, oob_pred = kfold.valid_predictions[:, 0], oob.valid_predictions[:, 0]
+    report = {
+        'kfold_rmse': kfold.rmse([1.0]),
+        'oob_rmse': oob.rmse([1.0]),
+        'rmse_relative_difference': abs(oob.rmse([1.0]) - kfold.rmse([1.0])) / kfold.rmse([1.0]),
+        'prediction_correlation': float(np.corrcoef(kfold_pred, oob_pred)[0, 1]),
+        'max_abs_difference': float(np.max(np.abs(kfold_pred - oob_pred)))
+    }
+    if verbose:
+        print(f"K-fold RMSE: {report['kfold_rmse']:.4f}, OOB RMSE: {report['oob_rmse']:.4f} "
+              f"(relative difference {report['rmse_relative_difference']:.2%}), "
+              f"prediction correlation: {report['prediction_correlation']:.4f}")
+    return report
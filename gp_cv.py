@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Closed-form K-fold predictions for a Gaussian process pipeline.
+
+With A = (K + alpha I)^-1 from one Cholesky factorization of the full
+training kernel matrix and a = A y, the predictive mean on a held-out block V
+of a GP conditioned on the remaining rows T is
+
+    y_V - (A_VV)^-1 a_V
+
+and the weights of that fold-GP for new points are a_T - A_TV (A_VV)^-1 a_V,
+so the out-of-fold and per-fold test predictions of all K folds come from a
+single fit. The result equals five separate fits when the kernel
+hyperparameters and the preprocessing are fixed; otherwise both are taken
+from the fit on all training rows instead of being refitted per fold.
+"""
+
+import numpy as np
+from scipy.linalg import cho_solve, cholesky
+from sklearn.pipeline import Pipeline
+
+
+# Pipeline whose last step is a GaussianProcessRegressor, compute_oof_predictions uses
+# cv_predict instead of one fit per fold
+class ClosedFormCVPipeline(Pipeline):
+
+    def cv_predict(self, X_train, y_train, X_test, folds):
+        self.fit(X_train, y_train)
+        gp = self.steps[-1][1]
+        Z_train, Z_test = X_train, X_test
+        for _, step in self.steps[:-1]:
+            Z_train, Z_test = step.transform(Z_train), step.transform(Z_test)
+
+        K = gp.kernel_(Z_train)
+        K[np.diag_indices_from(K)] += gp.alpha
+        L = cholesky(K, lower=True)
+        K_inv = cho_solve((L, True), np.eye(len(K)))
+        K_test = gp.kernel_(Z_test, Z_train)
+        # y_train_ is the normalized target when normalize_y=True
+        y = gp.y_train_
+        a = K_inv @ y
+
+        predictions = []
+        for train_idx, valid_idx in folds:
+            residual = np.linalg.solve(K_inv[np.ix_(valid_idx, valid_idx)], a[valid_idx])
+            a_fold = a[train_idx] - K_inv[np.ix_(train_idx, valid_idx)] @ residual
+            y_valid_pred = (y[valid_idx] - residual) * gp._y_train_std + gp._y_train_mean
+            y_test_pred = (K_test[:, train_idx] @ a_fold) * gp._y_train_std + gp._y_train_mean
+            predictions.append((y_valid_pred, y_test_pred, None))
+        return predictions
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Gaussian process regressor whose kernel hyperparameters are warm-started from disk.
+
+The first fit optimizes the kernel as usual (1 + n_restarts_optimizer L-BFGS
+starts) and stores the optimized theta together with its log-marginal-likelihood
+per training sample. Later fits (other folds, other evaluate_ensemble calls,
+reruns of the script) start a single L-BFGS run from the stored theta and only
+fall back to the full restarts when the likelihood per sample drops by more
+than lml_tol below the stored one.
+"""
+
+import os
+
+import joblib
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
+
+
+class WarmStartGaussianProcessRegressor(GaussianProcessRegressor):
+
+    def __init__(self, kernel=None, *, alpha=1e-10, optimizer='fmin_l_bfgs_b', n_restarts_optimizer=0,
+                 normalize_y=False, copy_X_train=True, n_targets=None, random_state=None, kernel_store=None,
+                 lml_tol=0.05):
+        super().__init__(kernel=kernel, alpha=alpha, optimizer=optimizer,
+                         n_restarts_optimizer=n_restarts_optimizer, normalize_y=normalize_y,
+                         copy_X_train=copy_X_train, n_targets=n_targets, random_state=random_state)
+        self.kernel_store = kernel_store
+        self.lml_tol = lml_tol
+
+    def _base_kernel(self):
+        # same default as GaussianProcessRegressor.fit
+        return C() * RBF() if self.kernel is None else self.kernel
+
+    def _load_seed(self):
+        if self.kernel_store is None or self.optimizer is None or not os.path.exists(self.kernel_store):
+            return None
+        seed = joblib.load(self.kernel_store)
+        # a store written for a different kernel structure is ignored
+        if len(seed['theta']) != self._base_kernel().n_dims:
+            return None
+        return seed
+
+    def _save_seed(self):
+        if self.kernel_store is None or self.optimizer is None:
+            return
+        seed = {'theta': self.kernel_.theta,
+                'lml_per_sample': self.log_marginal_likelihood_value_ / len(self.y_train_)}
+        tmp_path = f"{self.kernel_store}.{os.getpid()}.tmp"
+        joblib.dump(seed, tmp_path)
+        os.replace(tmp_path, self.kernel_store)
+
+    def fit(self, X, y):
+        seed = self._load_seed()
+        if seed is not None:
+            kernel, n_restarts_optimizer = self.kernel, self.n_restarts_optimizer
+            try:
+                self.kernel = self._base_kernel().clone_with_theta(seed['theta'])
+                self.n_restarts_optimizer = 0
+                super().fit(X, y)
+            finally:
+                self.kernel, self.n_restarts_optimizer = kernel, n_restarts_optimizer
+            # the likelihood is compared per sample so folds and the full training set are on the same scale
+            if self.log_marginal_likelihood_value_ / len(self.y_train_) >= seed['lml_per_sample'] - self.lml_tol:
+                self.warm_started_ = True
+                return self
+
+        super().fit(X, y)
+        self.warm_started_ = False
+        self._save_seed()
+        return self
@@ -21,7 +21,12 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 data = pd.read_csv('HTSMA.csv')
 X = data.iloc[:, 20:]
@@ -30,7 +35,7 @@ ym = data.iloc[:, 17]
 X_train, X_test, y_train, y_test = train_test_split(X, ym, test_size=0.2, random_state=42)
 
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -64,36 +69,56 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+# 'bayes' runs 50 BayesSearchCV trials per model, 'hyperband' tunes the forests with HyperbandSearchCV
+# (many configurations on few trees and part of the rows, only the best ones reach the full budget),
+# 'optuna' runs 50 fold-pruned Optuna trials per model kept in hyperparameter_tuning.db (a rerun resumes)
+tuner = 'bayes'
+# False skips refitting every model's best configuration on X_train: the models are compared on the CV RMSE
+# of their search and only the best one is refitted, once per target
+refit_every_model = True
+
 for name, (model, param_grid) in models.items():
     print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-
-    optimized_params[name] = bayes_search.best_params_
-
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
+    if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+        search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+    elif tuner == 'optuna':
+        search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                study_name=f"M2_Mm_{name}", refit=refit_every_model, random_state=42)
+    else:
+        search = BayesSearchCV(
+            estimator=model,
+            search_spaces=param_grid,
+            n_iter=50,
+            cv=5,
+            scoring='neg_mean_squared_error',
+            refit=refit_every_model,
+            random_state=42
+        )
+    cpu_budget.fit_search(name, search, X_train, y_train)
+
+    optimized_params[name] = search.best_params_
+
+    # CV RMSE of the best configuration, straight from the search results
+    performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+    if refit_every_model:
+        best_model = search.best_estimator_
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+
+        r2_train = r2_score(y_train, y_pred_train)
+        r2_test = r2_score(y_test, y_pred_test)
+        mae = mean_absolute_error(y_test, y_pred_test)
+        rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+        performance_metrics[name].update({
+            "R2 Train": r2_train,
+            "R2 Test": r2_test,
+            "MAE": mae,
+            "RMSE": rmse
+        })
 
     print(f"Best parameters for {name}: {optimized_params[name]}")
     print(f"Performance for {name}: {performance_metrics[name]}\n")
@@ -105,6 +130,23 @@ for name in models.keys():
     print(f"  Performance: {performance_metrics[name]}")
     print("\n")
 
+# Refit only the configuration with the lowest CV RMSE
+if not refit_every_model:
+    best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+    best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+    y_pred_train = best_model.predict(X_train)
+    y_pred_test = best_model.predict(X_test)
+    performance_metrics[best_name].update({
+        "R2 Train": r2_score(y_train, y_pred_train),
+        "R2 Test": r2_score(y_test, y_pred_test),
+        "MAE": mean_absolute_error(y_test, y_pred_test),
+        "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+    })
+    print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+print("CPU budget per model:")
+print(cpu_budget.report().to_string())
+
 """### **For Am prediction**"""
 
 import numpy as np
@@ -115,12 +157,17 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 X_train, X_test, y_train, y_test = train_test_split(X, ya, test_size=0.2, random_state=42)
 
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -154,36 +201,56 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+# 'bayes' runs 50 BayesSearchCV trials per model, 'hyperband' tunes the forests with HyperbandSearchCV
+# (many configurations on few trees and part of the rows, only the best ones reach the full budget),
+# 'optuna' runs 50 fold-pruned Optuna trials per model kept in hyperparameter_tuning.db (a rerun resumes)
+tuner = 'bayes'
+# False skips refitting every model's best configuration on X_train: the models are compared on the CV RMSE
+# of their search and only the best one is refitted, once per target
+refit_every_model = True
+
 for name, (model, param_grid) in models.items():
     print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-
-    optimized_params[name] = bayes_search.best_params_
-
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
+    if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+        search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+    elif tuner == 'optuna':
+        search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                study_name=f"M2_Am_{name}", refit=refit_every_model, random_state=42)
+    else:
+        search = BayesSearchCV(
+            estimator=model,
+            search_spaces=param_grid,
+            n_iter=50,
+            cv=5,
+            scoring='neg_mean_squared_error',
+            refit=refit_every_model,
+            random_state=42
+        )
+    cpu_budget.fit_search(name, search, X_train, y_train)
+
+    optimized_params[name] = search.best_params_
+
+    # CV RMSE of the best configuration, straight from the search results
+    performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+    if refit_every_model:
+        best_model = search.best_estimator_
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+
+        r2_train = r2_score(y_train, y_pred_train)
+        r2_test = r2_score(y_test, y_pred_test)
+        mae = mean_absolute_error(y_test, y_pred_test)
+        rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+        performance_metrics[name].update({
+            "R2 Train": r2_train,
+            "R2 Test": r2_test,
+            "MAE": mae,
+            "RMSE": rmse
+        })
 
     print(f"Best parameters for {name}: {optimized_params[name]}")
     print(f"Performance for {name}: {performance_metrics[name]}\n")
@@ -195,6 +262,23 @@ for name in models.keys():
     print(f"  Performance: {performance_metrics[name]}")
     print("\n")
 
+# Refit only the configuration with the lowest CV RMSE
+if not refit_every_model:
+    best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+    best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+    y_pred_train = best_model.predict(X_train)
+    y_pred_test = best_model.predict(X_test)
+    performance_metrics[best_name].update({
+        "R2 Train": r2_score(y_train, y_pred_train),
+        "R2 Test": r2_score(y_test, y_pred_test),
+        "MAE": mean_absolute_error(y_test, y_pred_test),
+        "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+    })
+    print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+print("CPU budget per model:")
+print(cpu_budget.report().to_string())
+
 """### **for Thermal hysteresis prediction**"""
 
 import numpy as np
@@ -205,12 +289,17 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 X_train, X_test, y_train, y_test = train_test_split(X, yth, test_size=0.2, random_state=42)
 
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -244,36 +333,56 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+# 'bayes' runs 50 BayesSearchCV trials per model, 'hyperband' tunes the forests with HyperbandSearchCV
+# (many configurations on few trees and part of the rows, only the best ones reach the full budget),
+# 'optuna' runs 50 fold-pruned Optuna trials per model kept in hyperparameter_tuning.db (a rerun resumes)
+tuner = 'bayes'
+# False skips refitting every model's best configuration on X_train: the models are compared on the CV RMSE
+# of their search and only the best one is refitted, once per target
+refit_every_model = True
+
 for name, (model, param_grid) in models.items():
     print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-
-    optimized_params[name] = bayes_search.best_params_
-
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
+    if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+        search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+    elif tuner == 'optuna':
+        search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                study_name=f"M2_TH_{name}", refit=refit_every_model, random_state=42)
+    else:
+        search = BayesSearchCV(
+            estimator=model,
+            search_spaces=param_grid,
+            n_iter=50,
+            cv=5,
+            scoring='neg_mean_squared_error',
+            refit=refit_every_model,
+            random_state=42
+        )
+    cpu_budget.fit_search(name, search, X_train, y_train)
+
+    optimized_params[name] = search.best_params_
+
+    # CV RMSE of the best configuration, straight from the search results
+    performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+    if refit_every_model:
+        best_model = search.best_estimator_
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+
+        r2_train = r2_score(y_train, y_pred_train)
+        r2_test = r2_score(y_test, y_pred_test)
+        mae = mean_absolute_error(y_test, y_pred_test)
+        rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+        performance_metrics[name].update({
+            "R2 Train": r2_train,
+            "R2 Test": r2_test,
+            "MAE": mae,
+            "RMSE": rmse
+        })
 
     print(f"Best parameters for {name}: {optimized_params[name]}")
     print(f"Performance for {name}: {performance_metrics[name]}\n")
@@ -283,4 +392,21 @@ for name in models.keys():
     print(f"{name}:")
     print(f"  Best Parameters: {optimized_params[name]}")
     print(f"  Performance: {performance_metrics[name]}")
-    print("\n")
\ No newline at end of file
+    print("\n")
+
+# Refit only the configuration with the lowest CV RMSE
+if not refit_every_model:
+    best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+    best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+    y_pred_train = best_model.predict(X_train)
+    y_pred_test = best_model.predict(X_test)
+    performance_metrics[best_name].update({
+        "R2 Train": r2_score(y_train, y_pred_train),
+        "R2 Test": r2_score(y_test, y_pred_test),
+        "MAE": mean_absolute_error(y_test, y_pred_test),
+        "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+    })
+    print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+print("CPU budget per model:")
+print(cpu_budget.report().to_string())
\ No newline at end of file
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Neighbor index for the KNN member shared by every fold.
+
+IndexedKNNPipeline fits its scaler and KD-/Ball-tree once on all training
+rows. The fold predictions query that index for n_neighbors plus the size of
+the validation block and drop the neighbors that belong to the validation
+block. Equally distant neighbors are ordered by training row, so the result
+is that of a KNN fitted on the remaining rows with the same tie rule.
+KNeighborsRegressor itself leaves the order of ties to its search algorithm,
+so on data with many ties (integer compositions with p=1) a refit-per-fold
+KNN can pick other tied neighbors and give different predictions. The
+distances are also measured in the scaling of the full training set instead
+of the per-fold one.
+"""
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+
+
+# KNeighborsRegressor weighting, a query at distance 0 from some neighbors only averages those
+def _neighbor_weights(distances, weights):
+    if weights == 'uniform':
+        return np.ones_like(distances)
+    with np.errstate(divide='ignore'):
+        inverse = 1.0 / distances
+    exact = np.isinf(inverse)
+    exact_rows = exact.any(axis=1)
+    inverse[exact_rows] = exact[exact_rows]
+    return inverse
+
+
+# Pipeline ending in a KNeighborsRegressor, compute_oof_predictions uses cv_predict
+# instead of one fit per fold
+class IndexedKNNPipeline(Pipeline):
+
+    def fit(self, X, y, **params):
+        super().fit(X, y, **params)
+        self.y_index_ = np.asarray(y, dtype=float)
+        return self
+
+    def _transform(self, X):
+        for _, step in self.steps[:-1]:
+            X = step.transform(X)
+        return X
+
+    # neighbors ordered by distance with ties broken by training row, the excluded rows moved to the back
+    def _sorted_neighbors(self, X, excluded, n_query):
+        distances, indices = self.steps[-1][1].kneighbors(X, n_neighbors=n_query)
+        order = np.lexsort((indices, distances, excluded[indices]))
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    # prediction from the neighbors among the rows that are not excluded
+    def predict_excluding(self, X, excluded):
+        knn = self.steps[-1][1]
+        if callable(knn.weights):
+            raise ValueError("IndexedKNNPipeline supports weights='uniform' or 'distance'")
+        X = self._transform(X)
+        n_query = min(knn.n_neighbors + int(excluded.sum()), len(excluded))
+        distances, indices = self._sorted_neighbors(X, excluded, n_query)
+        # a tie at the k-th kept distance can continue past the queried neighbors, those rows are
+        # queried again against every training row
+        edge = np.flatnonzero(distances[:, knn.n_neighbors - 1] >= distances.max(axis=1))
+        distances, indices = distances[:, :knn.n_neighbors], indices[:, :knn.n_neighbors]
+        if n_query < len(excluded) and len(edge):
+            X_edge = X.iloc[edge] if hasattr(X, 'iloc') else X[edge]
+            edge_distances, edge_indices = self._sorted_neighbors(X_edge, excluded, len(excluded))
+            distances[edge] = edge_distances[:, :knn.n_neighbors]
+            indices[edge] = edge_indices[:, :knn.n_neighbors]
+        weights = _neighbor_weights(distances, knn.weights)
+        return np.sum(weights * self.y_index_[indices], axis=1) / np.sum(weights, axis=1)
+
+    def cv_predict(self, X_train, y_train, X_test, folds):
+        self.fit(X_train, y_train)
+        predictions = []
+        for _, valid_idx in folds:
+            excluded = np.zeros(len(y_train), dtype=bool)
+            excluded[valid_idx] = True
+            y_valid_pred = self.predict_excluding(X_train.iloc[valid_idx] if hasattr(X_train, 'iloc')
+                                                  else X_train[valid_idx], excluded)
+            predictions.append((y_valid_pred, self.predict_excluding(X_test, excluded), None))
+        return predictions
+
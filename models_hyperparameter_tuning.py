@@ -11,6 +11,21 @@ pip install scikit-optimize
 
 pip install optuna
 
+"""### **Tuning options**"""
+
+# shared by every section below
+# 'bayes' runs 50 BayesSearchCV trials per model, 'hyperband' tunes the forests with HyperbandSearchCV
+# (many configurations on few trees and part of the rows, only the best ones reach the full budget),
+# 'optuna' runs 50 fold-pruned Optuna trials per model kept in hyperparameter_tuning.db (a rerun resumes)
+tuner = 'bayes'
+# False skips refitting every model's best configuration on X_train: the models are compared on the CV RMSE
+# of their search and only the best one is refitted, once per target
+refit_every_model = True
+# 'sequential' tunes the models target by target in the next three sections, 'scheduled' skips them and
+# runs all 15 model x target searches at once in the last section, each with a share of the cores sized by
+# its cost
+tuning_schedule = 'sequential'
+
 """### **For Mm prediction**"""
 
 import numpy as np
@@ -21,7 +36,12 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 data = pd.read_csv('/content/Processed_RawData_v2d (2).csv')
 X = data.iloc[:, 1:7]
@@ -30,7 +50,7 @@ y = data.iloc[:, 17]
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -64,44 +84,74 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
-for name, (model, param_grid) in models.items():
-    print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-    optimized_params[name] = bayes_search.best_params_
-
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
-
-    print(f"Best parameters for {name}: {optimized_params[name]}")
-    print(f"Performance for {name}: {performance_metrics[name]}\n")
-
-print("\nOptimized Hyperparameters and Metrics for All Models:\n")
-for name in models.keys():
-    print(f"{name}:")
-    print(f"  Best Parameters: {optimized_params[name]}")
-    print(f"  Performance: {performance_metrics[name]}")
-    print("\n")
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+if tuning_schedule == 'sequential':
+    for name, (model, param_grid) in models.items():
+        print(f"Optimizing {name}...")
+        if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+            search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+        elif tuner == 'optuna':
+            search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                    study_name=f"M1_Mm_{name}", refit=refit_every_model, random_state=42)
+        else:
+            search = BayesSearchCV(
+                estimator=model,
+                search_spaces=param_grid,
+                n_iter=50,
+                cv=5,
+                scoring='neg_mean_squared_error',
+                refit=refit_every_model,
+                random_state=42
+            )
+        cpu_budget.fit_search(name, search, X_train, y_train)
+        optimized_params[name] = search.best_params_
+
+        # CV RMSE of the best configuration, straight from the search results
+        performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+        if refit_every_model:
+            best_model = search.best_estimator_
+            y_pred_train = best_model.predict(X_train)
+            y_pred_test = best_model.predict(X_test)
+            r2_train = r2_score(y_train, y_pred_train)
+            r2_test = r2_score(y_test, y_pred_test)
+            mae = mean_absolute_error(y_test, y_pred_test)
+            rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+            performance_metrics[name].update({
+                "R2 Train": r2_train,
+                "R2 Test": r2_test,
+                "MAE": mae,
+                "RMSE": rmse
+            })
+
+        print(f"Best parameters for {name}: {optimized_params[name]}")
+        print(f"Performance for {name}: {performance_metrics[name]}\n")
+
+    print("\nOptimized Hyperparameters and Metrics for All Models:\n")
+    for name in models.keys():
+        print(f"{name}:")
+        print(f"  Best Parameters: {optimized_params[name]}")
+        print(f"  Performance: {performance_metrics[name]}")
+        print("\n")
+
+    # Refit only the configuration with the lowest CV RMSE
+    if not refit_every_model:
+        best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+        best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+        performance_metrics[best_name].update({
+            "R2 Train": r2_score(y_train, y_pred_train),
+            "R2 Test": r2_score(y_test, y_pred_test),
+            "MAE": mean_absolute_error(y_test, y_pred_test),
+            "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+        })
+        print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+    print("CPU budget per model:")
+    print(cpu_budget.report().to_string())
 
 """### **for Am prediction**"""
 
@@ -113,7 +163,12 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 # Sample dataset (replace with your actual data)
 data = pd.read_csv('/content/Processed_RawData_v2d (2).csv')
@@ -126,7 +181,7 @@ X_train, X_test, y_train, y_test = train_test_split(X, ya, test_size=0.2, random
 
 # Models and hyperparameter grids
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -161,51 +216,81 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
-# Tuning and evaluating each model
-for name, (model, param_grid) in models.items():
-    print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-
-    # Best parameters
-    optimized_params[name] = bayes_search.best_params_
-
-    # Predictions
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-
-    # Metrics
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
-
-    print(f"Best parameters for {name}: {optimized_params[name]}")
-    print(f"Performance for {name}: {performance_metrics[name]}\n")
-
-# Print summary of all models
-print("\nOptimized Hyperparameters and Metrics for All Models:\n")
-for name in models.keys():
-    print(f"{name}:")
-    print(f"  Best Parameters: {optimized_params[name]}")
-    print(f"  Performance: {performance_metrics[name]}")
-    print("\n")
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+if tuning_schedule == 'sequential':
+    # Tuning and evaluating each model
+    for name, (model, param_grid) in models.items():
+        print(f"Optimizing {name}...")
+        if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+            search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+        elif tuner == 'optuna':
+            search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                    study_name=f"M1_Am_{name}", refit=refit_every_model, random_state=42)
+        else:
+            search = BayesSearchCV(
+                estimator=model,
+                search_spaces=param_grid,
+                n_iter=50,
+                cv=5,
+                scoring='neg_mean_squared_error',
+                refit=refit_every_model,
+                random_state=42
+            )
+        cpu_budget.fit_search(name, search, X_train, y_train)
+
+        # Best parameters
+        optimized_params[name] = search.best_params_
+
+        # CV RMSE of the best configuration, straight from the search results
+        performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+        if refit_every_model:
+            # Predictions
+            best_model = search.best_estimator_
+            y_pred_train = best_model.predict(X_train)
+            y_pred_test = best_model.predict(X_test)
+
+            # Metrics
+            r2_train = r2_score(y_train, y_pred_train)
+            r2_test = r2_score(y_test, y_pred_test)
+            mae = mean_absolute_error(y_test, y_pred_test)
+            rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+            performance_metrics[name].update({
+                "R2 Train": r2_train,
+                "R2 Test": r2_test,
+                "MAE": mae,
+                "RMSE": rmse
+            })
+
+        print(f"Best parameters for {name}: {optimized_params[name]}")
+        print(f"Performance for {name}: {performance_metrics[name]}\n")
+
+    # Print summary of all models
+    print("\nOptimized Hyperparameters and Metrics for All Models:\n")
+    for name in models.keys():
+        print(f"{name}:")
+        print(f"  Best Parameters: {optimized_params[name]}")
+        print(f"  Performance: {performance_metrics[name]}")
+        print("\n")
+
+    # Refit only the configuration with the lowest CV RMSE
+    if not refit_every_model:
+        best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+        best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+        performance_metrics[best_name].update({
+            "R2 Train": r2_score(y_train, y_pred_train),
+            "R2 Test": r2_score(y_test, y_pred_test),
+            "MAE": mean_absolute_error(y_test, y_pred_test),
+            "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+        })
+        print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+    print("CPU budget per model:")
+    print(cpu_budget.report().to_string())
 
 """### **For thermal hysteresis prediction**"""
 
@@ -217,7 +302,12 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
 from skopt import BayesSearchCV
+from cpu_budget import CPUBudget
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
 
 # Sample dataset (replace with your actual data)
 data = pd.read_csv('/content/Processed_RawData_v2d (2).csv')
@@ -230,7 +320,7 @@ X_train, X_test, y_train, y_test = train_test_split(X, yth, test_size=0.2, rando
 
 # Models and hyperparameter grids
 models = {
-    "SVR": (SVR(), {
+    "SVR": (SharedKernelSVR(), {
         "C": (1e-3, 1e3, "log-uniform"),
         "epsilon": (1e-3, 1.0, "log-uniform"),
         "gamma": (1e-4, 1.0, "log-uniform"),
@@ -265,48 +355,243 @@ models = {
 optimized_params = {}
 performance_metrics = {}
 
-# Tuning and evaluating each model
-for name, (model, param_grid) in models.items():
-    print(f"Optimizing {name}...")
-    bayes_search = BayesSearchCV(
-        estimator=model,
-        search_spaces=param_grid,
-        n_iter=50,
-        cv=5,
-        scoring='neg_mean_squared_error',
-        n_jobs=-1,
-        random_state=42
-    )
-    bayes_search.fit(X_train, y_train)
-
-    # Best parameters
-    optimized_params[name] = bayes_search.best_params_
-
-    # Predictions
-    best_model = bayes_search.best_estimator_
-    y_pred_train = best_model.predict(X_train)
-    y_pred_test = best_model.predict(X_test)
-
-    # Metrics
-    r2_train = r2_score(y_train, y_pred_train)
-    r2_test = r2_score(y_test, y_pred_test)
-    mae = mean_absolute_error(y_test, y_pred_test)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-
-    performance_metrics[name] = {
-        "R2 Train": r2_train,
-        "R2 Test": r2_test,
-        "MAE": mae,
-        "RMSE": rmse
-    }
-
-    print(f"Best parameters for {name}: {optimized_params[name]}")
-    print(f"Performance for {name}: {performance_metrics[name]}\n")
-
-# Print summary of all models
-print("\nOptimized Hyperparameters and Metrics for All Models:\n")
-for name in models.keys():
-    print(f"{name}:")
-    print(f"  Best Parameters: {optimized_params[name]}")
-    print(f"  Performance: {performance_metrics[name]}")
-    print("\n")
\ No newline at end of file
+# search workers, forest n_jobs and BLAS threads share the machine's cores instead of each taking all of them
+cpu_budget = CPUBudget()
+if tuning_schedule == 'sequential':
+    # Tuning and evaluating each model
+    for name, (model, param_grid) in models.items():
+        print(f"Optimizing {name}...")
+        if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+            search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+        elif tuner == 'optuna':
+            search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                    study_name=f"M1_TH_{name}", refit=refit_every_model, random_state=42)
+        else:
+            search = BayesSearchCV(
+                estimator=model,
+                search_spaces=param_grid,
+                n_iter=50,
+                cv=5,
+                scoring='neg_mean_squared_error',
+                refit=refit_every_model,
+                random_state=42
+            )
+        cpu_budget.fit_search(name, search, X_train, y_train)
+
+        # Best parameters
+        optimized_params[name] = search.best_params_
+
+        # CV RMSE of the best configuration, straight from the search results
+        performance_metrics[name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+        if refit_every_model:
+            # Predictions
+            best_model = search.best_estimator_
+            y_pred_train = best_model.predict(X_train)
+            y_pred_test = best_model.predict(X_test)
+
+            # Metrics
+            r2_train = r2_score(y_train, y_pred_train)
+            r2_test = r2_score(y_test, y_pred_test)
+            mae = mean_absolute_error(y_test, y_pred_test)
+            rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+
+            performance_metrics[name].update({
+                "R2 Train": r2_train,
+                "R2 Test": r2_test,
+                "MAE": mae,
+                "RMSE": rmse
+            })
+
+        print(f"Best parameters for {name}: {optimized_params[name]}")
+        print(f"Performance for {name}: {performance_metrics[name]}\n")
+
+    # Print summary of all models
+    print("\nOptimized Hyperparameters and Metrics for All Models:\n")
+    for name in models.keys():
+        print(f"{name}:")
+        print(f"  Best Parameters: {optimized_params[name]}")
+        print(f"  Performance: {performance_metrics[name]}")
+        print("\n")
+
+    # Refit only the configuration with the lowest CV RMSE
+    if not refit_every_model:
+        best_name = min(performance_metrics, key=lambda name: performance_metrics[name]["CV RMSE"])
+        best_model = clone(models[best_name][0]).set_params(**optimized_params[best_name]).fit(X_train, y_train)
+        y_pred_train = best_model.predict(X_train)
+        y_pred_test = best_model.predict(X_test)
+        performance_metrics[best_name].update({
+            "R2 Train": r2_score(y_train, y_pred_train),
+            "R2 Test": r2_score(y_test, y_pred_test),
+            "MAE": mean_absolute_error(y_test, y_pred_test),
+            "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+        })
+        print(f"Refitted {best_name}: {performance_metrics[best_name]}\n")
+
+    print("CPU budget per model:")
+    print(cpu_budget.report().to_string())
+"""### **All models and targets at once**"""
+
+import numpy as np
+import pandas as pd
+from sklearn.svm import SVR
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.base import clone
+from skopt import BayesSearchCV
+from multi_fidelity import HyperbandSearchCV
+from optuna_tuning import OptunaSearchCV
+from svr_kernel import SharedKernelSVR
+from trial_library import OOFRecorder, build_trial_library
+from tuning_scheduler import run_tuning_jobs
+from weight_optimization import greedy_ensemble_selection
+
+# Load data
+data = pd.read_csv('/content/Processed_RawData_v2d (2).csv')
+X = data.iloc[:, 1:7]
+targets = {"Mm": data.iloc[:, 17], "Am": data.iloc[:, 18], "TH": data.iloc[:, 16]}
+
+splits = {target: train_test_split(X, y_target, test_size=0.2, random_state=42)
+          for target, y_target in targets.items()}
+
+# Models and hyperparameter grids
+models = {
+    "SVR": (SharedKernelSVR(), {
+        "C": (1e-3, 1e3, "log-uniform"),
+        "epsilon": (1e-3, 1.0, "log-uniform"),
+        "gamma": (1e-4, 1.0, "log-uniform"),
+        "kernel": ["linear", "rbf"]
+    }),
+    "RandomForest": (RandomForestRegressor(), {
+        "n_estimators": (50, 300),
+        "max_depth": (5, 30),
+        "min_samples_split": (2, 10),
+        "min_samples_leaf": (1, 5),
+        "bootstrap": [True, False]
+    }),
+    "ExtraTrees": (ExtraTreesRegressor(), {
+        "n_estimators": (50, 300),
+        "max_depth": (5, 30),
+        "min_samples_split": (2, 10),
+        "min_samples_leaf": (1, 5),
+        "bootstrap": [True, False]
+    }),
+    "GaussianProcess": (GaussianProcessRegressor(), {
+        "alpha": (1e-10, 1e-1, "log-uniform"),
+        "n_restarts_optimizer": (0, 10)
+    }),
+    "KNN": (KNeighborsRegressor(), {
+        "n_neighbors": (1, 20),
+        "weights": ["uniform", "distance"],
+        "p": (1, 2)  # Manhattan (1) or Euclidean (2)
+    })
+}
+
+# cores shared by all 15 searches (None = all of them); the GP and forest searches are started first, with
+# more cores when they alone would outlast the rest, and the SVR and KNN ones fill in, so the whole re-tune
+# takes about as long as the slowest single search
+n_cpus = None
+# True stores the out-of-fold and test predictions of every BayesSearchCV trial in trial_library/ and builds
+# one greedy forward-selection ensemble per target over all trials of all models, without any extra fit
+build_trial_ensemble = False
+# only the BayesSearchCV trials are scored by the recorders: HyperbandSearchCV scores reduced-budget fits and
+# OptunaSearchCV computes its own fold MSE, so their trials would be missing from the library
+if build_trial_ensemble and tuner != 'bayes':
+    raise ValueError(f"build_trial_ensemble needs tuner = 'bayes', got '{tuner}'")
+recorders = {target: OOFRecorder('trial_library', X_test=X_test)
+             for target, (X_train, X_test, y_train, y_test) in splits.items()}
+
+if tuning_schedule == 'scheduled':
+    # One independent job per target and model
+    jobs = {}
+    for target, (X_train, X_test, y_train, y_test) in splits.items():
+        for name, (model, param_grid) in models.items():
+            if tuner == 'hyperband' and name in ('RandomForest', 'ExtraTrees'):
+                search = HyperbandSearchCV(model, param_grid, cv=5, refit=refit_every_model, random_state=42)
+            elif tuner == 'optuna':
+                search = OptunaSearchCV(model, param_grid, n_trials=50, cv=5, pruner='median',
+                                        study_name=f"M1_{target}_{name}", refit=refit_every_model, random_state=42)
+            else:
+                search = BayesSearchCV(
+                    estimator=model,
+                    search_spaces=param_grid,
+                    n_iter=50,
+                    cv=5,
+                    scoring=recorders[target] if build_trial_ensemble else 'neg_mean_squared_error',
+                    refit=refit_every_model,
+                    random_state=42
+                )
+            jobs[target, name] = (search, X_train, y_train)
+
+    searches, schedule = run_tuning_jobs(jobs, n_cpus=n_cpus)
+
+    # Evaluating every tuned model on its target's test split
+    optimized_params = {}
+    performance_metrics = {}
+    for (target, name), search in searches.items():
+        X_train, X_test, y_train, y_test = splits[target]
+        optimized_params[target, name] = search.best_params_
+        performance_metrics[target, name] = {"CV RMSE": np.sqrt(-search.best_score_)}
+
+        # without refit_every_model only the best model of each target is refitted, below
+        if refit_every_model:
+            best_model = search.best_estimator_
+            y_pred_train = best_model.predict(X_train)
+            y_pred_test = best_model.predict(X_test)
+
+            performance_metrics[target, name].update({
+                "R2 Train": r2_score(y_train, y_pred_train),
+                "R2 Test": r2_score(y_test, y_pred_test),
+                "MAE": mean_absolute_error(y_test, y_pred_test),
+                "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+            })
+
+    if not refit_every_model:
+        for target, (X_train, X_test, y_train, y_test) in splits.items():
+            best_name = min(models, key=lambda name: performance_metrics[target, name]["CV RMSE"])
+            best_model = clone(models[best_name][0]).set_params(**optimized_params[target, best_name])
+            best_model.fit(X_train, y_train)
+            y_pred_train = best_model.predict(X_train)
+            y_pred_test = best_model.predict(X_test)
+            performance_metrics[target, best_name].update({
+                "R2 Train": r2_score(y_train, y_pred_train),
+                "R2 Test": r2_score(y_test, y_pred_test),
+                "MAE": mean_absolute_error(y_test, y_pred_test),
+                "RMSE": np.sqrt(mean_squared_error(y_test, y_pred_test))
+            })
+            print(f"Refitted {best_name} for {target}: {performance_metrics[target, best_name]}")
+
+    for target in targets:
+        print(f"\nOptimized Hyperparameters and Metrics for {target}:\n")
+        for name in models.keys():
+            print(f"{name}:")
+            print(f"  Best Parameters: {optimized_params[target, name]}")
+            print(f"  Performance: {performance_metrics[target, name]}")
+            print("\n")
+
+    print("Tuning schedule (longest jobs first):")
+    print(schedule.to_string())
+    print(f"Total wall time: {schedule.attrs['makespan_seconds']:.1f} s, "
+          f"longest job: {schedule['wall_seconds'].max():.1f} s, "
+          f"sum of all jobs: {schedule.attrs['sum_of_job_seconds']:.1f} s")
+
+    # Greedy ensemble selection over the library of all trials of one target
+    if build_trial_ensemble:
+        for target, (X_train, X_test, y_train, y_test) in splits.items():
+            library, members = build_trial_library({name: searches[target, name] for name in models},
+                                                   X_train, y_train, recorders[target])
+            trial_weights = greedy_ensemble_selection(library, n_iterations=100)
+            trial_rmse = np.sqrt(np.mean((library.valid_predictions - library.y_train[:, None]) ** 2, axis=0))
+            best_trial = library.model_names[int(np.argmin(trial_rmse))]
+            _, y_pred_test = library.blend(trial_weights)
+
+            print(f"\nTrial ensemble for {target} ({len(library.model_names)} configurations):")
+            for member, weight in sorted(trial_weights.items(), key=lambda item: -item[1]):
+                print(f"  {weight:.3f} x {member}")
+            print(f"  CV RMSE: ensemble {library.rmse(trial_weights):.4f}, "
+                  f"best single trial {library.rmse({best_trial: 1.0}):.4f} ({best_trial})")
+            print(f"  Test RMSE of the fold-averaged trial ensemble: "
+                  f"{np.sqrt(mean_squared_error(y_test, y_pred_test)):.4f}")
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Hyperband search with the tree count and the training-data fraction as the budget.
+
+Successive halving scores many random configurations on a small budget and
+promotes the best 1/eta of them to eta times the budget until the survivors
+run on the full budget. Hyperband runs several such brackets, from many
+configurations starting at min_budget down to a few configurations that start
+at the full budget, so a bad guess of how early the ranking stabilizes costs
+one bracket rather than the whole search. n_iterations repeats the brackets
+with fresh configurations.
+
+At budget b (0 < b <= 1) a configuration is fitted with b times its
+budget_param (n_estimators for the forests) and on a random b-fraction of
+every training fold, but never less than min_data_fraction of it. It is
+always scored on the full validation folds, so scores of different budgets
+stay comparable. Estimators without budget_param are budgeted on the data
+fraction only.
+
+The interface follows BayesSearchCV (search_spaces in skopt notation,
+best_params_, best_score_ as negative MSE, best_estimator_ refitted on all
+rows, cv_results_ with one entry per configuration and budget), so the tuning
+scripts and cpu_budget.CPUBudget can use it in its place.
+"""
+
+import math
+import time
+
+import numpy as np
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import check_cv
+from sklearn.utils import check_random_state
+from skopt.space import Space
+from skopt.utils import dimensions_aslist, point_asdict
+
+from ensemble_cv import _take_rows, run_fit_tasks
+
+
+def _fit_and_score(model, X_fit, y_fit, X_valid, y_valid):
+    start = time.perf_counter()
+    model.fit(X_fit, y_fit)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    score = -mean_squared_error(y_valid, model.predict(X_valid))
+    return score, fit_time, time.perf_counter() - start
+
+
+class HyperbandSearchCV(BaseEstimator):
+
+    def __init__(self, estimator, search_spaces, cv=5, eta=3, min_budget=1 / 27, min_data_fraction=1 / 3,
+                 budget_param='n_estimators', n_iterations=1, n_jobs=1, refit=True, random_state=None):
+        self.estimator = estimator
+        self.search_spaces = search_spaces
+        self.cv = cv
+        self.eta = eta
+        self.min_budget = min_budget
+        self.min_data_fraction = min_data_fraction
+        self.budget_param = budget_param
+        self.n_iterations = n_iterations
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.random_state = random_state
+
+    # s_max + 1 brackets per iteration, bracket s starts n configurations at budget eta^-s
+    def _s_max(self):
+        return int(math.floor(math.log(1 / self.min_budget, self.eta) + 1e-9))
+
+    # fits of the largest rung, the eta^s_max configurations that start the first bracket on every fold
+    def tasks_per_round(self, n_splits):
+        return int(math.ceil(self.eta ** self._s_max())) * n_splits
+
+    # params with budget_param scaled to the budget, taken from the estimator when it is not searched
+    def _budget_params(self, params, budget):
+        params = dict(params)
+        full = params.get(self.budget_param, self.estimator.get_params().get(self.budget_param))
+        if full is not None:
+            params[self.budget_param] = max(1, int(round(full * budget)))
+        return params
+
+    # mean validation score of every configuration at one budget, every configuration x fold fit is one task
+    def _run_rung(self, X, y, folds, configurations, budget, bracket, rng):
+        fraction = max(budget, self.min_data_fraction)
+        fit_rows = [rng.choice(train_idx, size=max(2, int(round(fraction * len(train_idx)))), replace=False)
+                    if fraction < 1 else train_idx for train_idx, _ in folds]
+        tasks = {}
+        for candidate, params in enumerate(configurations):
+            model = clone(self.estimator).set_params(**self._budget_params(params, budget))
+            for fold, ((_, valid_idx), rows) in enumerate(zip(folds, fit_rows)):
+                tasks[candidate, fold] = (_fit_and_score, clone(model), _take_rows(X, rows), _take_rows(y, rows),
+                                          _take_rows(X, valid_idx), _take_rows(y, valid_idx))
+        results = run_fit_tasks(tasks, n_jobs=self.n_jobs)
+
+        scores = []
+        for candidate, params in enumerate(configurations):
+            fold_results = np.array([results[candidate, fold] for fold in range(len(folds))])
+            scores.append(fold_results[:, 0].mean())
+            self._results.append({'params': params, 'budget': budget, 'bracket': bracket,
+                                  'mean_test_score': scores[-1], 'mean_fit_time': fold_results[:, 1].mean(),
+                                  'mean_score_time': fold_results[:, 2].mean()})
+        return np.array(scores)
+
+    def fit(self, X, y):
+        rng = check_random_state(self.random_state)
+        space = Space(dimensions_aslist(self.search_spaces))
+        folds = list(check_cv(self.cv).split(X, y))
+        self._results = []
+
+        s_max = self._s_max()
+        for _ in range(self.n_iterations):
+            for s in range(s_max, -1, -1):
+                n_configurations = int(math.ceil((s_max + 1) / (s + 1) * self.eta ** s))
+                configurations = [dict(point_asdict(self.search_spaces, point))
+                                  for point in space.rvs(n_configurations, random_state=rng)]
+                for rung in range(s + 1):
+                    budget = self.eta ** (rung - s)
+                    scores = self._run_rung(X, y, folds, configurations, budget, s, rng)
+                    if rung < s:
+                        keep = np.argsort(-scores, kind='stable')[:max(1, len(configurations) // self.eta)]
+                        configurations = [configurations[i] for i in keep]
+
+        self.cv_results_ = {key: np.array([result[key] for result in self._results])
+                            for key in ('budget', 'bracket', 'mean_test_score', 'mean_fit_time', 'mean_score_time')}
+        self.cv_results_['params'] = [result['params'] for result in self._results]
+        # only full-budget scores compete for the best configuration
+        full_budget = [i for i, result in enumerate(self._results) if result['budget'] == 1]
+        self.best_index_ = max(full_budget, key=lambda i: self._results[i]['mean_test_score'])
+        self.best_params_ = self._results[self.best_index_]['params']
+        self.best_score_ = self._results[self.best_index_]['mean_test_score']
+        self.n_fits_ = len(self._results) * len(folds)
+        if self.refit:
+            start = time.perf_counter()
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+            self.refit_time_ = time.perf_counter() - start
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
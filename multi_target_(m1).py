@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Multi-target (M1)
+
+Mm, Am and thermal hysteresis ensembles fitted in one run on the shared M1 composition features.
+
+### **Required package installations**
+"""
+
+# !pip install scikit-optimize
+
+"""### **Shared data preparation and fold fitting**"""
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split, KFold
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import Pipeline
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+from sklearn.neighbors import KNeighborsRegressor
+from ensemble_cv import compute_oof_predictions_multi, prune_weights, WeightedEnsemble
+from fold_cache import FoldCache
+from forest_engine import compile_forests
+from gp_warm_start import WarmStartGaussianProcessRegressor
+from svr_kernel import SharedKernelSVR
+from weight_optimization import fit_simplex_weights
+
+# True warm-starts every GP fit from the kernel hyperparameters the previous fit (or run) left in its
+# *_gp_kernel.joblib store, False fits every fold from scratch so the folds do not depend on each other
+warm_start_gp = False
+
+# tuned pipelines of every target, same hyperparameters as in mm_(m1).py, am_(m1).py and thermal_hysteresis_(m1).py,
+# the GP kernel stores (warm_start_gp) are shared with those scripts
+model_definitions_by_target = {
+    'Mm': {
+        'SVR': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', SharedKernelSVR(C=150.2053834224418, epsilon=1.0, gamma=0.001218266700169731, kernel='rbf'))
+        ]),
+        'RandomForest': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', RandomForestRegressor(bootstrap=False, max_depth=17, min_samples_leaf=2,
+                                            min_samples_split=4, n_estimators=167, random_state=42))
+        ]),
+        'ExtraTrees': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', ExtraTreesRegressor(bootstrap=False, max_depth=5, min_samples_leaf=1,
+                                          min_samples_split=2, n_estimators=300, random_state=42))
+        ]),
+        'GaussianProcess': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', WarmStartGaussianProcessRegressor(
+                alpha=0.081183958953274, n_restarts_optimizer=10,
+                kernel_store='Mm_M1_gp_kernel.joblib' if warm_start_gp else None))
+        ]),
+        'KNN': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', KNeighborsRegressor(n_neighbors=3, p=1, weights='uniform'))
+        ])
+    },
+    'Am': {
+        'SVR': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', SharedKernelSVR(C=1000, epsilon=1.0, gamma=0.0007665189689585275, kernel='rbf'))
+        ]),
+        'RandomForest': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', RandomForestRegressor(bootstrap=True, max_depth=30, min_samples_leaf=1,
+                                            min_samples_split=3, n_estimators=300, random_state=42))
+        ]),
+        'ExtraTrees': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', ExtraTreesRegressor(bootstrap=True, max_depth=5, min_samples_leaf=1,
+                                          min_samples_split=2, n_estimators=50, random_state=42))
+        ]),
+        'GaussianProcess': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', WarmStartGaussianProcessRegressor(
+                alpha=0.07653054285055239, n_restarts_optimizer=10,
+                kernel_store='Am_M1_gp_kernel.joblib' if warm_start_gp else None))
+        ]),
+        'KNN': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', KNeighborsRegressor(n_neighbors=3, p=1, weights='uniform'))
+        ])
+    },
+    'Thermal hysteresis': {
+        'SVR': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', SharedKernelSVR(C=216.16323805007437, epsilon=0.001, gamma=0.003939299318210304, kernel='rbf'))
+        ]),
+        'RandomForest': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', RandomForestRegressor(bootstrap=True, max_depth=5, min_samples_leaf=1,
+                                            min_samples_split=10, n_estimators=300, random_state=42))
+        ]),
+        'ExtraTrees': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', ExtraTreesRegressor(bootstrap=True, max_depth=30, min_samples_leaf=1,
+                                          min_samples_split=10, n_estimators=50, random_state=42))
+        ]),
+        'GaussianProcess': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', WarmStartGaussianProcessRegressor(
+                alpha=0.04989548385032647, n_restarts_optimizer=7,
+                kernel_store='TH_M1_gp_kernel.joblib' if warm_start_gp else None))
+        ]),
+        'KNN': Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', KNeighborsRegressor(n_neighbors=5, p=1, weights='uniform'))
+        ])
+    }
+}
+
+# Dataset Preparation
+data = pd.read_csv('HTSMA_DATA.csv')
+X = data.iloc[:, 1:7]
+target_columns = {'Mm': 17, 'Am': 18, 'Thermal hysteresis': 16}
+
+# the split only depends on the number of rows and the seed, so one split serves every target
+train_rows, test_rows = train_test_split(np.arange(len(data)), test_size=0.2, random_state=42)
+X_train, X_test = X.iloc[train_rows], X.iloc[test_rows]
+y_train_by_target = {target: data.iloc[train_rows, column] for target, column in target_columns.items()}
+y_test_by_target = {target: data.iloc[test_rows, column] for target, column in target_columns.items()}
+
+kf = KFold(n_splits=5, shuffle=True, random_state=42)
+fold_cache = FoldCache('fold_cache')
+
+# the 3 targets x 5 folds x 5 models = 75 fits are scheduled as one batch on the process pool,
+# each fold is standardized once and shared by all members of all targets
+model_names = ['RandomForest', 'SVR', 'ExtraTrees', 'GaussianProcess', 'KNN']
+oof_by_target = compute_oof_predictions_multi(model_definitions_by_target, X_train, y_train_by_target, X_test, kf,
+                                              model_names=model_names, keep_models=True, n_jobs=-1, cache=fold_cache,
+                                              share_scaling=True)
+
+"""### **Weights and performance for every target**"""
+
+def save_performance_csv(y_train, y_train_pred_ensemble, y_test, y_test_pred_ensemble, filename):
+    train_sigma = np.std(y_train - y_train_pred_ensemble)
+    test_sigma = np.std(y_test - y_test_pred_ensemble)
+    mean_sigma = (train_sigma + test_sigma) / 2
+    decision_line_x = np.linspace(min(min(y_train), min(y_test)), max(max(y_train), max(y_test)), 100)
+
+    columns = {
+        'Prediction Train': y_train_pred_ensemble,
+        'Actual Train': y_train,
+        'Prediction Test': y_test_pred_ensemble,
+        'Actual Test': y_test,
+        'Decision Line X': decision_line_x,
+        'Decision Line Y': decision_line_x,
+        'Upper Sigma': decision_line_x + mean_sigma,
+        'Lower Sigma': decision_line_x - mean_sigma,
+        'Upper 2Sigma': decision_line_x + 2 * mean_sigma,
+        'Lower 2Sigma': decision_line_x - 2 * mean_sigma
+    }
+    max_len = max(len(values) for values in columns.values())
+    plot_data = pd.DataFrame({name: np.pad(np.asarray(values, dtype=float), (0, max_len - len(values)),
+                                           constant_values=np.nan)
+                              for name, values in columns.items()})
+    plot_data.to_csv(filename, index=False)
+
+
+optimal_weights_by_target = {}
+for target, oof in oof_by_target.items():
+    y_train, y_test = y_train_by_target[target], y_test_by_target[target]
+    optimal_weights = fit_simplex_weights(oof)
+    # zero-weight members are skipped when the composition grid is scored
+    optimal_weights_by_target[target] = prune_weights(dict(zip(oof.model_names, optimal_weights)))
+    y_train_pred_ensemble, y_test_pred_ensemble = oof.blend(optimal_weights)
+
+    train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
+    train_r2 = r2_score(y_train, y_train_pred_ensemble)
+    test_rmse = np.sqrt(mean_squared_error(y_test, y_test_pred_ensemble))
+    test_r2 = r2_score(y_test, y_test_pred_ensemble)
+
+    rf_weight, svr_weight, et_weight, gp_weight, knn_weight = optimal_weights
+    print(f"{target}")
+    print(f"Optimal Weights: RF = {rf_weight:.4f}, SVR = {svr_weight:.4f}, ET = {et_weight:.4f}, GP = {gp_weight:.4f}, KNN = {knn_weight:.4f}")
+    print(f"Training Set - RMSE: {train_rmse:.4f}, R²: {train_r2:.4f}")
+    print(f"Testing Set - RMSE: {test_rmse:.4f}, R²: {test_r2:.4f}\n")
+
+    save_performance_csv(y_train, y_train_pred_ensemble, y_test, y_test_pred_ensemble,
+                         f"{target.replace(' ', '_')}_performance.csv")
+
+"""### **Composition plots for every target**"""
+
+# one composition grid, scored for every target with the models fitted on the last fold, the forests
+# through the flat-array engine after checking it against their own predict on the test rows
+grid_models = {target: compile_forests(oof.fold_models[-1], X_check=X_test)
+               for target, oof in oof_by_target.items()}
+
+def generate_combinations_and_save(columns, filename):
+    combinations = []
+
+    for ti in range(1, 101):
+        for ni in range(1, 101 - ti):
+            third_element = 100 - ni - ti
+            if third_element > 0:
+                combinations.append([ni, ti, third_element])
+
+    combinations_df = pd.DataFrame(combinations, columns=columns)
+
+    X_custom = pd.DataFrame(0, index=np.arange(len(combinations)), columns=X.columns)
+    X_custom['Ni'] = combinations_df['Ni']
+    X_custom['Ti'] = combinations_df['Ti']
+    X_custom[columns[2]] = combinations_df[columns[2]]
+
+    for target, oof in oof_by_target.items():
+        ensemble = WeightedEnsemble(grid_models[target], optimal_weights_by_target[target])
+        combinations_df[f"Predicted {target}"] = ensemble.predict(X_custom)
+
+    combinations_df.to_csv(filename, index=False)
+    print(f"File saved: {filename}")
+    print(combinations_df.head())
+
+generate_combinations_and_save(['Ni', 'Ti', 'Zr'], 'Ni_Ti_Zr_combinations_all_targets.csv')
+generate_combinations_and_save(['Ni', 'Ti', 'Hf'], 'Ni_Ti_Hf_combinations_all_targets.csv')
+generate_combinations_and_save(['Ni', 'Ti', 'Pd'], 'Ni_Ti_Pd_combinations_all_targets.csv')
+generate_combinations_and_save(['Ni', 'Ti', 'Pt'], 'Ni_Ti_Pt_combinations_all_targets.csv')
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Optuna tuning backend with per-fold pruning and an SQLite study store.
+
+OptunaSearchCV takes the same search_spaces as BayesSearchCV in the tuning
+scripts ((low, high) ranges, (low, high, 'log-uniform') and lists of
+categories). Every trial fits the CV folds one after the other and reports
+the mean MSE of the folds so far after each of them, so the median pruner or
+the asynchronous successive halving pruner ('asha') can stop a poor
+configuration after one or two folds.
+
+Studies live in storage (a local SQLite file by default) under study_name,
+so scripts sharing a storage need study names that also say which data they
+tune on. n_trials is the number of finished (complete or pruned) trials the
+study should hold: fitting again resumes an interrupted study and a larger
+n_trials extends it. n_jobs > 1 runs that many worker processes against the
+same study, each with its own sampler seed. A trial only runs if fewer than
+n_trials other trials started before it, so the workers together never
+finish more than n_trials.
+
+A pruned trial has only scored some of the folds, so cv_results_ keeps it
+(its fit time counts) with a NaN mean_test_score.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import optuna
+from optuna.trial import TrialState
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import check_cv
+
+from ensemble_cv import _resolve_n_jobs, _take_rows
+
+FINISHED_STATES = (TrialState.COMPLETE, TrialState.PRUNED)
+
+
+# one parameter from a skopt-style dimension
+def suggest_param(trial, name, dimension):
+    if isinstance(dimension, list):
+        return trial.suggest_categorical(name, dimension)
+    low, high = dimension[:2]
+    log = len(dimension) > 2 and dimension[2] == 'log-uniform'
+    if isinstance(low, int) and isinstance(high, int):
+        return trial.suggest_int(name, low, high, log=log)
+    return trial.suggest_float(name, low, high, log=log)
+
+
+def _make_pruner(pruner):
+    if pruner == 'median':
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+    if pruner == 'asha':
+        return optuna.pruners.SuccessiveHalvingPruner()
+    if pruner is None:
+        return optuna.pruners.NopPruner()
+    raise ValueError(f"Unknown pruner '{pruner}', expected 'median', 'asha' or None")
+
+
+# runs trials until the study holds search.n_trials started or finished ones, also as a worker process
+def _optimize(search, study_name, X, y, folds, seed):
+    study = optuna.load_study(study_name=study_name, storage=search.storage,
+                              sampler=optuna.samplers.TPESampler(seed=seed), pruner=_make_pruner(search.pruner))
+    started_states = FINISHED_STATES + (TrialState.RUNNING,)
+    while len(study.get_trials(deepcopy=False, states=started_states)) < search.n_trials:
+        trial = study.ask()
+        # another worker may have started a trial in between, only the first n_trials started ones run
+        started = study.get_trials(deepcopy=False, states=started_states)
+        if sum(other.number < trial.number for other in started) >= search.n_trials:
+            study.tell(trial, state=TrialState.FAIL)
+            return
+        try:
+            value = search._objective(trial, X, y, folds)
+        except optuna.TrialPruned:
+            study.tell(trial, state=TrialState.PRUNED)
+        except Exception:
+            study.tell(trial, state=TrialState.FAIL)
+            raise
+        else:
+            study.tell(trial, value)
+
+
+class OptunaSearchCV(BaseEstimator):
+
+    def __init__(self, estimator, search_spaces, n_trials=50, cv=5, pruner='median',
+                 storage='sqlite:///hyperparameter_tuning.db', study_name=None, n_jobs=1, refit=True,
+                 random_state=None):
+        self.estimator = estimator
+        self.search_spaces = search_spaces
+        self.n_trials = n_trials
+        self.cv = cv
+        self.pruner = pruner
+        self.storage = storage
+        self.study_name = study_name
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.random_state = random_state
+
+    # every worker process runs one trial at a time and its folds one after the other
+    def tasks_per_round(self, n_splits):
+        return self.n_trials
+
+    # creates the storage's tables; searches fitted concurrently on one fresh database (tuning_scheduler
+    # jobs) would otherwise race to create them
+    def prepare_storage(self):
+        if isinstance(self.storage, str):
+            optuna.storages.RDBStorage(self.storage)
+
+    # mean validation MSE over the folds, reported after every fold for the pruner
+    def _objective(self, trial, X, y, folds):
+        params = {name: suggest_param(trial, name, dimension) for name, dimension in self.search_spaces.items()}
+        errors, fit_time, score_time = [], 0.0, 0.0
+        for fold, (train_idx, valid_idx) in enumerate(folds):
+            model = clone(self.estimator).set_params(**params)
+            start = time.perf_counter()
+            model.fit(_take_rows(X, train_idx), _take_rows(y, train_idx))
+            fit_time += time.perf_counter() - start
+            start = time.perf_counter()
+            errors.append(mean_squared_error(_take_rows(y, valid_idx), model.predict(_take_rows(X, valid_idx))))
+            score_time += time.perf_counter() - start
+            trial.set_user_attr('fit_time', fit_time)
+            trial.set_user_attr('score_time', score_time)
+            trial.report(float(np.mean(errors)), fold)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+        return float(np.mean(errors))
+
+    def fit(self, X, y):
+        folds = list(check_cv(self.cv).split(X, y))
+        study_name = self.study_name or f"{type(self.estimator).__name__}_search"
+        # created once here so the workers only load it
+        self.study_ = optuna.create_study(study_name=study_name, storage=self.storage, direction='minimize',
+                                          load_if_exists=True)
+        # trials left running by an interrupted fit would never finish but count as started
+        for trial in self.study_.get_trials(deepcopy=False, states=(TrialState.RUNNING,)):
+            self.study_.tell(trial.number, state=TrialState.FAIL)
+        seed = 0 if self.random_state is None else self.random_state
+        n_workers = _resolve_n_jobs(self.n_jobs)
+        if n_workers <= 1:
+            _optimize(self, study_name, X, y, folds, seed)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                for future in [executor.submit(_optimize, self, study_name, X, y, folds, seed + worker)
+                               for worker in range(n_workers)]:
+                    future.result()
+
+        self.study_ = optuna.load_study(study_name=study_name, storage=self.storage)
+        trials = self.study_.get_trials(deepcopy=False, states=FINISHED_STATES)
+        # per-fold averages over all folds, so busy time = (mean_fit_time + mean_score_time) x n_splits
+        self.cv_results_ = {
+            'params': [trial.params for trial in trials],
+            'state': np.array([trial.state.name for trial in trials]),
+            'mean_test_score': np.array([-trial.value if trial.state == TrialState.COMPLETE else np.nan
+                                         for trial in trials]),
+            'mean_fit_time': np.array([trial.user_attrs.get('fit_time', 0.0) / len(folds) for trial in trials]),
+            'mean_score_time': np.array([trial.user_attrs.get('score_time', 0.0) / len(folds) for trial in trials])
+        }
+        self.best_params_ = self.study_.best_params
+        self.best_score_ = -self.study_.best_value
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
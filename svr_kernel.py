@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""SVR on a precomputed kernel built from cached pairwise matrices.
+
+The RBF kernel only depends on gamma through exp(-gamma * D) with D the
+squared euclidean distances, and the linear kernel is the plain Gram matrix,
+so both are stored per pair of input matrices and every fit/predict with the
+same (scaled) rows only pays for the exponentiation and the QP solve. Sweeping
+C, epsilon and gamma over the same CV splits in BayesSearchCV, or re-running
+the same folds, hits the cache after the first pass.
+
+The cache lives in the process: BayesSearchCV's joblib workers keep theirs
+between trials, a fresh process pool starts empty.
+"""
+
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.svm import SVR
+from sklearn.utils.validation import check_is_fitted
+
+_pairwise_cache = OrderedDict()
+MAX_CACHED_MATRICES = 64
+
+
+# squared distances ('rbf') or inner products ('linear') between the rows of X and Y, kept in an LRU cache
+def pairwise_matrix(kind, X, Y):
+    key = (kind, joblib.hash(X), joblib.hash(Y))
+    if key in _pairwise_cache:
+        _pairwise_cache.move_to_end(key)
+        return _pairwise_cache[key]
+    if kind == 'rbf':
+        matrix = euclidean_distances(X, Y, squared=True)
+    else:
+        matrix = X @ Y.T
+    _pairwise_cache[key] = matrix
+    if len(_pairwise_cache) > MAX_CACHED_MATRICES:
+        _pairwise_cache.popitem(last=False)
+    return matrix
+
+
+def clear_pairwise_cache():
+    _pairwise_cache.clear()
+
+
+# drop-in replacement for SVR(kernel='rbf'|'linear') that reuses the cached pairwise matrices
+class SharedKernelSVR(RegressorMixin, BaseEstimator):
+
+    def __init__(self, kernel='rbf', gamma='scale', C=1.0, epsilon=0.1, tol=1e-3, shrinking=True,
+                 cache_size=200, max_iter=-1):
+        self.kernel = kernel
+        self.gamma = gamma
+        self.C = C
+        self.epsilon = epsilon
+        self.tol = tol
+        self.shrinking = shrinking
+        self.cache_size = cache_size
+        self.max_iter = max_iter
+
+    def _kernel_matrix(self, X, Y):
+        matrix = pairwise_matrix(self.kernel, X, Y)
+        return np.exp(-self._gamma * matrix) if self.kernel == 'rbf' else matrix
+
+    def fit(self, X, y):
+        if self.kernel not in ('rbf', 'linear'):
+            raise ValueError(f"Unknown kernel '{self.kernel}', expected 'rbf' or 'linear'")
+        X = np.ascontiguousarray(X, dtype=float)
+        # same gamma conventions as SVR
+        if self.gamma == 'scale':
+            self._gamma = 1.0 / (X.shape[1] * X.var()) if X.var() > 0 else 1.0
+        elif self.gamma == 'auto':
+            self._gamma = 1.0 / X.shape[1]
+        else:
+            self._gamma = float(self.gamma)
+        self.X_fit_ = X
+        self.n_features_in_ = X.shape[1]
+        self.svr_ = SVR(kernel='precomputed', C=self.C, epsilon=self.epsilon, tol=self.tol,
+                        shrinking=self.shrinking, cache_size=self.cache_size, max_iter=self.max_iter)
+        self.svr_.fit(self._kernel_matrix(X, X), np.asarray(y, dtype=float))
+        return self
+
+    def predict(self, X):
+        check_is_fitted(self, 'svr_')
+        X = np.ascontiguousarray(X, dtype=float)
+        return self.svr_.predict(self._kernel_matrix(X, self.X_fit_))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Bit-for-bit agreement of forest_engine.FlatForest with the forests' own predict.
+
+Covers the tuned RandomForest/ExtraTrees pipelines of the M1 scripts on
+HTSMA_Data.csv through both the bitvector tables and the node traversal, their
+float32 (quantized) copies, and a deep synthetic forest whose leaf masks need
+several table words. The checked rows include compositions placed exactly on
+the split thresholds, where a rounding difference would send a row the other way.
+
+Run with python -m pytest test_forest_engine.py
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from forest_engine import FlatForest, check_flat_forest
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HTSMA_Data.csv')
+
+# target column and tuned forest of am_(m1).py, mm_(m1).py and thermal_hysteresis_(m1).py
+SCRIPT_FORESTS = {
+    'Am_RandomForest': (18, RandomForestRegressor(bootstrap=True, max_depth=30, min_samples_leaf=1,
+                                                  min_samples_split=3, n_estimators=300, random_state=42)),
+    'Am_ExtraTrees': (18, ExtraTreesRegressor(bootstrap=True, max_depth=5, min_samples_leaf=1,
+                                              min_samples_split=2, n_estimators=50, random_state=42)),
+    'Mm_RandomForest': (17, RandomForestRegressor(bootstrap=False, max_depth=17, min_samples_leaf=2,
+                                                  min_samples_split=4, n_estimators=167, random_state=42)),
+    'Mm_ExtraTrees': (17, ExtraTreesRegressor(bootstrap=False, max_depth=5, min_samples_leaf=1,
+                                              min_samples_split=2, n_estimators=300, random_state=42)),
+    'TH_RandomForest': (16, RandomForestRegressor(bootstrap=True, max_depth=5, min_samples_leaf=1,
+                                                  min_samples_split=10, n_estimators=300, random_state=42)),
+    'TH_ExtraTrees': (16, ExtraTreesRegressor(bootstrap=True, max_depth=30, min_samples_leaf=1,
+                                              min_samples_split=10, n_estimators=50, random_state=42))
+}
+
+
+# rows whose every feature sits exactly on one of the forest's thresholds for that feature
+def _threshold_rows(forest, n_rows, rng):
+    rows = rng.normal(size=(n_rows, forest.n_features_in_))
+    for feature in range(forest.n_features_in_):
+        thresholds = np.concatenate([estimator.tree_.threshold[estimator.tree_.feature == feature]
+                                     for estimator in forest.estimators_])
+        if len(thresholds):
+            rows[:, feature] = rng.choice(thresholds, size=n_rows)
+    return rows
+
+
+@lru_cache(maxsize=None)
+def _script_case(name):
+    column, forest = SCRIPT_FORESTS[name]
+    data = pd.read_csv(DATA_PATH, index_col=0)
+    X, y = data.iloc[:, 1:7], data.iloc[:, column]
+    X_train, X_test, y_train, _ = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = Pipeline([('scaler', StandardScaler()), ('model', forest)]).fit(X_train, y_train)
+
+    rng = np.random.default_rng(0)
+    compositions = pd.DataFrame(rng.uniform(X_train.min(), X_train.max(), size=(2000, X.shape[1])),
+                                columns=X.columns)
+    X_check = pd.concat([X_train, X_test, compositions], ignore_index=True)
+    # the threshold rows go to the forest itself, in the scaled space its thresholds live in
+    return model, X_check, _threshold_rows(model[-1], 2000, rng)
+
+
+@lru_cache(maxsize=None)
+def _deep_case():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(1000, 6))
+    y = X[:, 0] * 3 + np.sin(X[:, 1] * 2) + rng.normal(scale=0.1, size=1000)
+    forest = ExtraTreesRegressor(n_estimators=20, random_state=0).fit(X, y)
+    X_check = np.vstack([X, rng.normal(size=(2000, 6)), _threshold_rows(forest, 2000, rng)])
+    return forest, X_check
+
+
+# predictions of a float32 FlatForest rebuilt from sklearn's own leaf assignment: float32 leaf values
+# summed in tree order, as FlatForest.predict accumulates them
+def _quantized_reference(forest, X):
+    X = np.asarray(X, dtype=np.float32)
+    total = np.zeros(len(X))
+    for estimator in forest.estimators_:
+        total += estimator.tree_.value[estimator.apply(X), 0, 0].astype(np.float32)
+    return total / len(forest.estimators_)
+
+
+def _check_quantized(forest, flat_forest, X):
+    quantized = flat_forest.quantized()
+    rows = np.asarray(X, dtype=np.float32).astype(np.float64)
+    # every row reaches the same leaf as in the float64 forest and in sklearn
+    sklearn_leaves = np.column_stack([estimator.apply(np.asarray(X, dtype=np.float32))
+                                      for estimator in forest.estimators_])
+    assert np.array_equal(quantized.apply(rows) - quantized.roots, sklearn_leaves)
+    expected = _quantized_reference(forest, X)
+    assert np.array_equal(quantized.predict(X), expected)
+    quantized.max_table_bytes = 0
+    assert np.array_equal(quantized.predict(X), expected)
+
+
+@pytest.mark.parametrize('name', list(SCRIPT_FORESTS))
+def test_tables_match_predict(name):
+    model, X_check, threshold_rows = _script_case(name)
+    flat_forest = FlatForest.from_model(model)
+    assert flat_forest.table_words == 1
+    assert check_flat_forest(model, X_check, flat_forest) == 0.0
+    assert check_flat_forest(model[-1], threshold_rows) == 0.0
+
+
+@pytest.mark.parametrize('name', list(SCRIPT_FORESTS))
+def test_traversal_matches_predict(name):
+    model, X_check, threshold_rows = _script_case(name)
+    flat_forest = FlatForest.from_model(model)
+    flat_forest.max_table_bytes = 0
+    assert flat_forest.table_words is None
+    assert check_flat_forest(model, X_check, flat_forest) == 0.0
+    raw_forest = FlatForest.from_model(model[-1])
+    raw_forest.max_table_bytes = 0
+    assert check_flat_forest(model[-1], threshold_rows, raw_forest) == 0.0
+
+
+@pytest.mark.parametrize('name', list(SCRIPT_FORESTS))
+def test_quantized_matches_float32_leaves(name):
+    model, _, threshold_rows = _script_case(name)
+    _check_quantized(model[-1], FlatForest.from_model(model[-1]), threshold_rows)
+
+
+def test_multi_word_tables_match_predict():
+    forest, X_check = _deep_case()
+    flat_forest = FlatForest.from_model(forest)
+    assert flat_forest.table_words > 1
+    assert check_flat_forest(forest, X_check, flat_forest) == 0.0
+    # batches that do not divide the rows evenly
+    assert np.array_equal(flat_forest.predict(X_check, batch_size=37), forest.predict(X_check))
+    _check_quantized(forest, flat_forest, X_check)
+
+
+def test_save_load_round_trip(tmp_path):
+    model, X_check, _ = _script_case('Am_RandomForest')
+    flat_forest = FlatForest.from_model(model)
+    flat_forest.save(tmp_path / 'forest.npz')
+    loaded = FlatForest.load(tmp_path / 'forest.npz', preprocess=flat_forest.preprocess)
+    assert check_flat_forest(model, X_check, loaded) == 0.0
@@ -25,30 +25,60 @@ from sklearn.svm import SVR
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
-from skopt import gp_minimize
 from skopt.space import Real
+from ensemble_cv import compute_oof_predictions, fit_model
+from fold_cache import FoldCache
+from forest_compression import compression_report, prune_forest, select_trees
+from forest_engine import FlatForest
+from forest_oob import OOBForestPipeline, oob_equivalence_check
+from gp_cv import ClosedFormCVPipeline
+from gp_warm_start import WarmStartGaussianProcessRegressor
+from knn_index import IndexedKNNPipeline
+from svr_kernel import SharedKernelSVR
+from weight_optimization import (batch_gp_minimize, calls_to_reach, fit_simplex_weights, gp_minimize_simplex,
+                                 gp_minimize_with_checkpoint, sample_simplex_weights, sweep_weights)
+
+# 'per_fold' refits the GP on every fold, 'closed_form' derives the predictions of all folds from one
+# Cholesky factorization of the full training kernel (kernel hyperparameters and scaler are then fitted
+# once on all training rows instead of per fold)
+gp_cv_mode = 'per_fold'
+gp_pipeline = ClosedFormCVPipeline if gp_cv_mode == 'closed_form' else Pipeline
+# 'per_fold' refits the KNN on every fold, 'shared_index' builds one neighbor index over all training rows
+# and answers every fold by masking its validation rows (distances use the full-train scaling)
+knn_cv_mode = 'per_fold'
+knn_pipeline = IndexedKNNPipeline if knn_cv_mode == 'shared_index' else Pipeline
+# 'k_fold' refits the bootstrap forests on every fold, 'oob' uses the out-of-bag predictions of one
+# full-train forest as their validation predictions (see forest_oob.oob_equivalence_check)
+forest_cv_mode = 'k_fold'
+forest_pipeline = OOBForestPipeline if forest_cv_mode == 'oob' else Pipeline
+# True warm-starts every GP fit from the kernel hyperparameters the previous fit (or run) left in its
+# *_gp_kernel.joblib store, False fits every fold from scratch so the folds do not depend on each other
+warm_start_gp = False
 
 # pipeline creation for ensemble model that contains all the considered algorithm with tunned hyperparameters
 model_definitions = {
     'SVR': Pipeline([
         ('scaler', StandardScaler()),
-        ('model', SVR(C=216.16323805007437, epsilon=0.001, gamma=0.003939299318210304, kernel='rbf'))
+        ('model', SharedKernelSVR(C=216.16323805007437, epsilon=0.001, gamma=0.003939299318210304, kernel='rbf'))
     ]),
-    'RandomForest': Pipeline([
+    'RandomForest': forest_pipeline([
         ('scaler', StandardScaler()),
         ('model', RandomForestRegressor(bootstrap=True, max_depth=5, min_samples_leaf=1,
                                         min_samples_split=10, n_estimators=300, random_state=42))
     ]),
-    'ExtraTrees': Pipeline([
+    'ExtraTrees': forest_pipeline([
         ('scaler', StandardScaler()),
         ('model', ExtraTreesRegressor(bootstrap=True, max_depth=30, min_samples_leaf=1,
                                       min_samples_split=10, n_estimators=50, random_state=42))
     ]),
-    'GaussianProcess': Pipeline([
+    # with warm_start_gp the kernel hyperparameters of the previous fold/run seed the next fit, restarts
+    # only run when the log-marginal-likelihood degrades
+    'GaussianProcess': gp_pipeline([
         ('scaler', StandardScaler()),
-        ('model', GaussianProcessRegressor(alpha=0.04989548385032647, n_restarts_optimizer=7))
+        ('model', WarmStartGaussianProcessRegressor(alpha=0.04989548385032647, n_restarts_optimizer=7,
+                                                    kernel_store='TH_M1_gp_kernel.joblib' if warm_start_gp else None))
     ]),
-    'KNN': Pipeline([
+    'KNN': knn_pipeline([
         ('scaler', StandardScaler()),
         ('model', KNeighborsRegressor(n_neighbors=5, p=1, weights='uniform'))
     ])
@@ -63,44 +93,25 @@ X_train, X_test, y_train, y_test = train_test_split(X, yth, test_size=0.2, rando
 # Optmization through K-cross validation
 kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
-def evaluate_ensemble(weights):
-    rf_weight, svr_weight, et_weight, gp_weight, knn_weight = weights
-    y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-    y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-    for train_idx, valid_idx in kf.split(X_train):
-
-        X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-        y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-        fold_train_predictions = {}
-        fold_test_predictions = {}
-        for model_name in model_definitions:
-            model = model_definitions[model_name]
-            model.fit(X_train_fold, y_train_fold)
-            y_valid_pred = model.predict(X_valid_fold)
-            y_test_pred = model.predict(X_test)
-
-            fold_train_predictions[model_name] = y_valid_pred
-            fold_test_predictions[model_name] = y_test_pred
+# fitted fold models and predictions are stored on disk and reused by the later sections
+fold_cache = FoldCache('fold_cache')
 
-        fold_train_ensemble = (rf_weight * fold_train_predictions['RandomForest'] +
-                               svr_weight * fold_train_predictions['SVR'] +
-                               et_weight * fold_train_predictions['ExtraTrees'] +
-                               gp_weight * fold_train_predictions['GaussianProcess'] +
-                               knn_weight * fold_train_predictions['KNN'])
+# the OOB validation predictions are only a statistical stand-in for the K-fold ones, so their
+# agreement is reported before they are used for the weights
+if forest_cv_mode == 'oob':
+    for model_name in ['RandomForest', 'ExtraTrees']:
+        print(f"{model_name} OOB vs K-fold")
+        oob_equivalence_check(model_definitions[model_name], X_train, y_train, kf)
 
-        fold_test_ensemble = (rf_weight * fold_test_predictions['RandomForest'] +
-                              svr_weight * fold_test_predictions['SVR'] +
-                              et_weight * fold_test_predictions['ExtraTrees'] +
-                              gp_weight * fold_test_predictions['GaussianProcess'] +
-                              knn_weight * fold_test_predictions['KNN'])
+# base-model predictions do not depend on the weights, so every model is fitted on every fold only once,
+# the 25 fold x model fits run on a process pool (n_jobs=-1 uses every core), every fold is standardized
+# once for all members (share_scaling=True)
+oof = compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf,
+                              model_names=['RandomForest', 'SVR', 'ExtraTrees', 'GaussianProcess', 'KNN'],
+                              n_jobs=-1, cache=fold_cache, share_scaling=True)
 
-        y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-        y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
-
-    val_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
-    return val_rmse
+def evaluate_ensemble(weights):
+    return oof.rmse(weights)
 
 search_space = [
     Real(0, 1, name='rf_weight'),
@@ -114,42 +125,39 @@ def objective(weights):
     normalized_weights = [w / sum(weights) for w in weights]
     return evaluate_ensemble(normalized_weights)
 
-result = gp_minimize(objective, search_space, n_calls=50, random_state=42)
-optimal_weights = [w / sum(result.x) for w in result.x]
+# weight_solver options:
+#   'simplex'             optimal non-negative, sum-to-one weights computed directly
+#   'sweep'               random Dirichlet candidates scored in one batch
+#   'gp_minimize'         Bayesian search over five Real(0, 1) weights, normalized afterwards,
+#                         with early stopping and checkpoint/resume
+#   'gp_minimize_batch'   the same search evaluated in concurrent batches of 4 points
+#   'gp_minimize_simplex' Bayesian search directly on the 4-dimensional simplex
+weight_solver = 'simplex'
+
+if weight_solver == 'simplex':
+    optimal_weights = list(fit_simplex_weights(oof))
+elif weight_solver == 'sweep':
+    candidate_weights = sample_simplex_weights(100000, len(oof.model_names), random_state=42)
+    optimal_weights = list(sweep_weights(oof, candidate_weights)[0])
+elif weight_solver == 'gp_minimize_batch':
+    result = batch_gp_minimize(objective, search_space, n_calls=50, batch_size=4, random_state=42)
+    optimal_weights = [w / sum(result.x) for w in result.x]
+elif weight_solver == 'gp_minimize_simplex':
+    result = gp_minimize_simplex(evaluate_ensemble, oof.model_names, n_calls=50, random_state=42)
+    optimal_weights = list(result.weights)
+    target_rmse = oof.rmse(fit_simplex_weights(oof))
+    print(f"Calls needed to reach the optimal RMSE {target_rmse:.4f} (within 0.1%): "
+          f"{calls_to_reach(result.func_vals, target_rmse)}")
+else:
+    # stops after 15 calls without an RMSE improvement above 1e-4 and checkpoints every call,
+    # an interrupted run resumes from the checkpoint (delete it to start over)
+    result = gp_minimize_with_checkpoint(objective, search_space, n_calls=50, random_state=42,
+                                         checkpoint_path='TH_M1_weight_search.pkl', resume=True,
+                                         tol=1e-4, patience=15)
+    optimal_weights = [w / sum(result.x) for w in result.x]
 
 rf_weight, svr_weight, et_weight, gp_weight, knn_weight = optimal_weights
-y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-for train_idx, valid_idx in kf.split(X_train):
-    X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-    y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-    fold_train_predictions = {}
-    fold_test_predictions = {}
-    for model_name in model_definitions:
-        model = model_definitions[model_name]
-        model.fit(X_train_fold, y_train_fold)
-        y_valid_pred = model.predict(X_valid_fold)
-        y_test_pred = model.predict(X_test)
-
-        fold_train_predictions[model_name] = y_valid_pred
-        fold_test_predictions[model_name] = y_test_pred
-
-    fold_train_ensemble = (rf_weight * fold_train_predictions['RandomForest'] +
-                           svr_weight * fold_train_predictions['SVR'] +
-                           et_weight * fold_train_predictions['ExtraTrees'] +
-                           gp_weight * fold_train_predictions['GaussianProcess'] +
-                           knn_weight * fold_train_predictions['KNN'])
-
-    fold_test_ensemble = (rf_weight * fold_test_predictions['RandomForest'] +
-                          svr_weight * fold_test_predictions['SVR'] +
-                          et_weight * fold_test_predictions['ExtraTrees'] +
-                          gp_weight * fold_test_predictions['GaussianProcess'] +
-                          knn_weight * fold_test_predictions['KNN'])
-
-    y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-    y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
+y_train_pred_ensemble, y_test_pred_ensemble = oof.blend(optimal_weights)
 
 # Calculate RMSE and R² for the training and testing set
 train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
@@ -161,6 +169,20 @@ print(f"Optimal Weights: RF = {rf_weight:.4f}, SVR = {svr_weight:.4f}, ET = {et_
 print(f"Training Set - RMSE: {train_rmse:.4f}, R²: {train_r2:.4f}")
 print(f"Testing Set - RMSE: {test_rmse:.4f}, R²: {test_r2:.4f}")
 
+# True stores a deployable RandomForest: the fewest leading trees (at least 10) whose OOF RMSE stays within
+# 1% of the full forest and whose OOF predictions stay within 10% of its RMSE of the full forest's ones, as
+# float32 node arrays, with size, load time, predict latency and prediction difference before and after
+compress_random_forest = False
+if compress_random_forest:
+    selection = select_trees(model_definitions['RandomForest'], X_train, y_train, kf, tolerance=0.01,
+                             cache=fold_cache)
+    full_forest = fit_model(model_definitions['RandomForest'], X_train, y_train, cache=fold_cache)
+    pruned_forest = prune_forest(full_forest, selection['n_trees'])
+    compressed_forest = FlatForest.from_model(pruned_forest).quantized()
+    compressed_forest.save('TH_M1_random_forest.npz')
+    print(compression_report({'full': full_forest, 'pruned': pruned_forest, 'pruned float32': compressed_forest},
+                             X_test).to_string())
+
 """### **Performance of Weight optimized model**"""
 
 import numpy as np
@@ -174,6 +196,7 @@ from sklearn.neighbors import KNeighborsRegressor
 from sklearn.svm import SVR
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
+from ensemble_cv import compute_oof_predictions, prune_weights
 
 model_definitions = {
     'SVR': Pipeline([
@@ -205,39 +228,13 @@ knn_weight, svr_weight, rfr_weight, et_weight, gp_weight = optimal_weights
 
 kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
-y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-for train_idx, valid_idx in kf.split(X_train):
-    X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-    y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-    fold_train_predictions = {}
-    fold_test_predictions = {}
-
-    for model_name in model_definitions:
-        model = model_definitions[model_name]
-        model.fit(X_train_fold, y_train_fold)
-        y_valid_pred = model.predict(X_valid_fold)
-        y_test_pred = model.predict(X_test)
-
-        fold_train_predictions[model_name] = y_valid_pred
-        fold_test_predictions[model_name] = y_test_pred
-
-    fold_train_ensemble = (knn_weight * fold_train_predictions['KNN'] +
-                           svr_weight * fold_train_predictions['SVR'] +
-                           rfr_weight * fold_train_predictions['RandomForest'] +
-                           et_weight * fold_train_predictions['ExtraTrees'] +
-                           gp_weight * fold_train_predictions['GaussianProcess'])
-
-    fold_test_ensemble = (knn_weight * fold_test_predictions['KNN'] +
-                          svr_weight * fold_test_predictions['SVR'] +
-                          rfr_weight * fold_test_predictions['RandomForest'] +
-                          et_weight * fold_test_predictions['ExtraTrees'] +
-                          gp_weight * fold_test_predictions['GaussianProcess'])
-
-    y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-    y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
+# members with a zero weight are neither fitted nor predicted
+ensemble_weights = prune_weights({'KNN': knn_weight, 'SVR': svr_weight, 'RandomForest': rfr_weight,
+                                  'ExtraTrees': et_weight, 'GaussianProcess': gp_weight})
+oof = compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf,
+                              model_names=list(ensemble_weights), n_jobs=-1, cache=fold_cache,
+                              share_scaling=True)
+y_train_pred_ensemble, y_test_pred_ensemble = oof.blend(ensemble_weights)
 
 train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
 train_r2 = r2_score(y_train, y_train_pred_ensemble)
@@ -328,6 +325,7 @@ from sklearn.svm import SVR
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.inspection import PartialDependenceDisplay, partial_dependence
+from ensemble_cv import fit_model, prune_weights
 
 X_train, X_test, y_train, y_test = train_test_split(X, yth, test_size=0.2, random_state=42)
 
@@ -358,17 +356,15 @@ model_definitions = {
 
 optimal_weights = [0.0000, 0.0000, 0.1754, 0.0000, 0.8246]
 model_names = list(model_definitions.keys())
-weights = dict(zip(model_names, optimal_weights))
+weights = prune_weights(dict(zip(model_names, optimal_weights)))
 
 ensemble_importances = np.zeros(X.shape[1])
 
 for model_name, weight in weights.items():
-    if weight > 0:
-        model = model_definitions[model_name]
-        model.fit(X_train, y_train)
-        if hasattr(model.named_steps['model'], 'feature_importances_'):
-            model_importances = model.named_steps['model'].feature_importances_
-            ensemble_importances += weight * model_importances
+    model = fit_model(model_definitions[model_name], X_train, y_train, cache=fold_cache)
+    if hasattr(model.named_steps['model'], 'feature_importances_'):
+        model_importances = model.named_steps['model'].feature_importances_
+        ensemble_importances += weight * model_importances
 
 ensemble_importances /= sum(weights.values())
 
@@ -400,6 +396,9 @@ from sklearn.svm import SVR
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.metrics import mean_squared_error, r2_score
+from ensemble_cv import compute_oof_predictions, prune_weights, WeightedEnsemble
+from ensemble_distillation import distill_ensemble, sample_compositions
+from forest_engine import compile_forests
 
 model_definitions = {
     'SVR': Pipeline([
@@ -438,34 +437,19 @@ knn_weight, svr_weight, rfr_weight, et_weight, gp_weight = optimal_weights
 
 kf = KFold(n_splits=5, shuffle=True, random_state=42)
 
-y_train_pred_ensemble = np.zeros_like(y_train, dtype=float)
-y_test_pred_ensemble = np.zeros_like(y_test, dtype=float)
-
-for train_idx, valid_idx in kf.split(X_train):
-    X_train_fold, X_valid_fold = X_train.iloc[train_idx], X_train.iloc[valid_idx]
-    y_train_fold, y_valid_fold = y_train.iloc[train_idx], y_train.iloc[valid_idx]
-
-    fold_train_predictions = {}
-    fold_test_predictions = {}
-
-
-    for model_name in ['SVR', 'RandomForest', 'ExtraTrees', 'GaussianProcess', 'KNN']:
-        model = model_definitions[model_name]
-        model.fit(X_train_fold, y_train_fold)
-        fold_train_predictions[model_name] = model.predict(X_valid_fold)
-        fold_test_predictions[model_name] = model.predict(X_test)
-
-
-    fold_train_ensemble = (knn_weight * fold_train_predictions['KNN'] +
-                           svr_weight * fold_train_predictions['SVR'] +
-                           rfr_weight * fold_train_predictions['RandomForest'])
-
-    fold_test_ensemble = (knn_weight * fold_test_predictions['KNN'] +
-                          svr_weight * fold_test_predictions['SVR'] +
-                          rfr_weight * fold_test_predictions['RandomForest'])
+# members with a zero weight are neither fitted nor predicted, the grid keeps its own
+# (SVR, RF, ET, GP, KNN) reading of optimal_weights
+ensemble_weights = prune_weights({'KNN': knn_weight, 'SVR': svr_weight, 'RandomForest': rfr_weight})
+grid_weights = prune_weights(dict(zip(['SVR', 'RandomForest', 'ExtraTrees', 'GaussianProcess', 'KNN'],
+                                      optimal_weights)))
+active_models = [name for name in model_definitions if name in ensemble_weights or name in grid_weights]
+oof = compute_oof_predictions(model_definitions, X_train, y_train, X_test, kf, model_names=active_models,
+                              n_jobs=-1, cache=fold_cache, keep_models=True, share_scaling=True)
+y_train_pred_ensemble, y_test_pred_ensemble = oof.blend(ensemble_weights)
 
-    y_train_pred_ensemble[valid_idx] = fold_train_ensemble
-    y_test_pred_ensemble += fold_test_ensemble / kf.n_splits
+# the composition grid is scored with the models fitted on the last fold, the forests through the
+# flat-array engine after checking it against their own predict on the test rows
+grid_ensemble = WeightedEnsemble(compile_forests(oof.fold_models[-1], X_check=X_test), grid_weights)
 
 train_rmse = np.sqrt(mean_squared_error(y_train, y_train_pred_ensemble))
 train_r2 = r2_score(y_train, y_train_pred_ensemble)
@@ -477,7 +461,19 @@ print(f"Training R²: {train_r2:.4f}")
 print(f"Test RMSE: {test_rmse:.4f}")
 print(f"Test R²: {test_r2:.4f}")
 
-def generate_combinations_and_save(columns, filename):
+# 'ensemble' scores the composition grids with grid_ensemble, 'surrogate' with one small MLP distilled from
+# it on random Ni-Ti-X compositions (its deviation from the ensemble is printed before it is used)
+grid_predictor = 'ensemble'
+grid_model = grid_ensemble
+if grid_predictor == 'surrogate':
+    grid_systems = [['Ni', 'Ti', element] for element in ['Zr', 'Hf', 'Pd', 'Pt']]
+    grid_model, distillation_report = distill_ensemble(
+        grid_ensemble, sample_compositions(X.columns, grid_systems, 200000, random_state=42),
+        sample_compositions(X.columns, grid_systems, 20000, random_state=43))
+
+# predictor defaults to the grid_predictor choice, any fitted regressor on X's columns can be passed instead
+def generate_combinations_and_save(columns, filename, predictor=None):
+    predictor = grid_model if predictor is None else predictor
     combinations = []
 
     for ti in range(1, 101):
@@ -493,10 +489,7 @@ def generate_combinations_and_save(columns, filename):
     X_custom['Ti'] = combinations_df['Ti']
     X_custom[columns[2]] = combinations_df[columns[2]]
 
-    predicted_temperatures = np.zeros(len(X_custom))
-    for model_name, weight in zip(['SVR', 'RandomForest', 'ExtraTrees', 'GaussianProcess', 'KNN'], optimal_weights):
-        model = model_definitions[model_name]
-        predicted_temperatures += weight * model.predict(X_custom)
+    predicted_temperatures = predictor.predict(X_custom)
 
     combinations_df['Predicted Temperature'] = predicted_temperatures
 
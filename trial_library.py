@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Library of the out-of-fold predictions of every tuning trial.
+
+A BayesSearchCV trial fits its configuration on every CV fold and scores it on
+the validation rows, then the predictions are dropped. OOFRecorder is a
+scoring callable that computes the same negative MSE but also stores the
+validation predictions (and, with X_test, the fold model's test predictions)
+in a fold_cache.FoldCache directory. That works from the search's worker
+processes and from the tuning_scheduler jobs alike.
+
+build_trial_library collects the stored predictions of every trial of one or
+more fitted searches into an ensemble_cv.OOFPredictions with one column per
+distinct configuration, so the ensemble weight solvers (e.g.
+weight_optimization.greedy_ensemble_selection) run on hundreds of candidates
+without fitting any model again. Only the configurations that end up in the
+ensemble have to be fitted for new data.
+"""
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import check_cv
+
+from ensemble_cv import OOFPredictions, _take_rows
+from fold_cache import FoldCache
+
+
+class OOFRecorder:
+
+    def __init__(self, directory='trial_library', X_test=None):
+        self.directory = directory
+        self.X_test = X_test
+        self.cache = FoldCache(directory)
+
+    # the stored values, not the row labels or frame layout, identify a fold's validation rows
+    def key(self, estimator, X_valid, y_valid):
+        return self.cache.key(estimator, np.ascontiguousarray(X_valid, dtype=float),
+                              np.ascontiguousarray(y_valid, dtype=float))
+
+    # scorer signature, returns the same value as scoring='neg_mean_squared_error'
+    def __call__(self, estimator, X, y):
+        y_pred = estimator.predict(X)
+        y_test_pred = estimator.predict(self.X_test) if self.X_test is not None else None
+        self.cache.put(self.key(estimator, X, y), (y_pred, y_test_pred))
+        return -mean_squared_error(y, y_pred)
+
+
+# (OOFPredictions over every recorded configuration of searches {name: fitted search}, {member: unfitted
+# estimator}); members are named '<name>_<trial>', repeated configurations are kept once and trials with
+# a fold missing from the recorder are skipped. A search without any recorded trial (e.g. one not scored
+# by the recorder) raises instead of silently dropping out of the library
+def build_trial_library(searches, X_train, y_train, recorder):
+    members, seen = {}, set()
+    valid_columns, test_columns = [], []
+    folds = None
+    for name, search in searches.items():
+        search_folds = [(np.asarray(train_idx), np.asarray(valid_idx))
+                        for train_idx, valid_idx in check_cv(search.cv).split(X_train, y_train)]
+        if folds is None:
+            folds = search_folds
+        elif len(search_folds) != len(folds) or any(not np.array_equal(valid_idx, other_idx)
+                                                    for (_, valid_idx), (_, other_idx) in zip(search_folds, folds)):
+            raise ValueError(f"The folds of search '{name}' differ from those of the other searches")
+
+        n_recorded = 0
+        for trial, params in enumerate(search.cv_results_['params']):
+            estimator = clone(search.estimator).set_params(**params)
+            fold_keys = [recorder.key(estimator, _take_rows(X_train, valid_idx), _take_rows(y_train, valid_idx))
+                         for _, valid_idx in folds]
+            if fold_keys[0] in seen:
+                n_recorded += 1
+                continue
+            entries = [recorder.cache.get(key) for key in fold_keys]
+            if any(entry is None for entry in entries):
+                continue
+            seen.add(fold_keys[0])
+            n_recorded += 1
+
+            valid_predictions = np.full(len(y_train), np.nan)
+            for (_, valid_idx), (y_pred, _) in zip(folds, entries):
+                valid_predictions[valid_idx] = y_pred
+            valid_columns.append(valid_predictions)
+            if recorder.X_test is not None:
+                test_columns.append(np.mean([y_test_pred for _, y_test_pred in entries], axis=0))
+            members[f"{name}_{trial}"] = estimator
+        if not n_recorded:
+            raise ValueError(f"No trial of search '{name}' was recorded, pass the OOFRecorder as its scoring")
+
+    if not members:
+        raise ValueError("No searches were given")
+    test_predictions = np.column_stack(test_columns) if test_columns else None
+    return OOFPredictions(list(members), y_train, np.column_stack(valid_columns), test_predictions,
+                          folds), members
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Concurrent scheduler for independent tuning jobs.
+
+The model families x targets searches of the tuning scripts do not depend on
+each other. run_tuning_jobs runs them on one process pool under a fixed core
+budget and starts them longest first (largest-processing-time-first), so the
+expensive GP and forest searches start right away and the cheap SVR and KNN
+ones fill the remaining gaps. The total time then approaches that of the
+slowest job instead of the sum of all of them.
+
+The cost of a job is taken from costs (e.g. the wall times of a previous
+run's schedule report) or else from the estimator family in DEFAULT_COSTS.
+It also sets the job's share of the cores: the ideal total time is the summed
+cost over n_cpus, and a job that alone would take longer gets as many cores
+as it needs to fit in it, every other job gets one. The costliest pending job
+whose share is free starts next, and it fits through its own
+cpu_budget.CPUBudget of that many cores, so the searches do not oversubscribe
+the machine either.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from joblib.externals.loky import get_reusable_executor
+import pandas as pd
+
+from cpu_budget import CPUBudget
+
+# relative tuning cost by estimator class name, the ones not listed count as 1
+DEFAULT_COSTS = {
+    'GaussianProcessRegressor': 5,
+    'WarmStartGaussianProcessRegressor': 5,
+    'RandomForestRegressor': 4,
+    'ExtraTreesRegressor': 4,
+    'SVR': 2,
+    'SharedKernelSVR': 2,
+    'KNeighborsRegressor': 1
+}
+
+
+def _job_cost(key, search, costs):
+    if costs is not None and key in costs:
+        return costs[key]
+    estimator = search.estimator
+    if hasattr(estimator, 'steps'):
+        estimator = estimator.steps[-1][1]
+    return DEFAULT_COSTS.get(type(estimator).__name__, 1)
+
+
+# {key: cores}, enough cores for every job to finish within the ideal time sum(costs) / n_cpus
+def core_shares(costs, n_cpus):
+    ideal_time = sum(costs.values()) / n_cpus
+    return {key: min(n_cpus, max(1, math.ceil(cost / ideal_time - 1e-9))) for key, cost in costs.items()}
+
+
+# wall-clock start offsets, as the jobs run in other processes
+def _run_job(name, search, X, y, n_cpus, scheduler_start):
+    start = time.time()
+    budget = CPUBudget(n_cpus)
+    budget.fit_search(name, search, X, y)
+    if budget.runs[0]['search_jobs'] > 1:
+        # a pool worker exits without running atexit hooks, so it would wait for the idle loky workers to time out
+        get_reusable_executor(reuse=True).shutdown(wait=True)
+    return search, budget.runs[0], start - scheduler_start, time.time() - start
+
+
+# {key: (search, X, y)} fitted concurrently under n_cpus cores, returns ({key: fitted search}, schedule report)
+def run_tuning_jobs(jobs, n_cpus=None, costs=None):
+    n_cpus = n_cpus or os.cpu_count() or 1
+    job_costs = {key: _job_cost(key, jobs[key][0], costs) for key in jobs}
+    shares = core_shares(job_costs, n_cpus)
+    order = sorted(jobs, key=lambda key: -job_costs[key])
+
+    # a storage shared by several jobs (e.g. one Optuna database) is set up once here, not by racing jobs
+    for search, _, _ in jobs.values():
+        if hasattr(search, 'prepare_storage'):
+            search.prepare_storage()
+
+    pending, running, results = list(order), {}, {}
+    free_cpus = n_cpus
+    scheduler_start = time.time()
+    with ProcessPoolExecutor(max_workers=max(1, min(n_cpus, len(jobs)))) as executor:
+        while pending or running:
+            # the costliest pending job whose share of the cores is free starts next
+            while pending:
+                fitting = [key for key in pending if shares[key] <= free_cpus]
+                if not fitting and running:
+                    break
+                key = fitting[0] if fitting else pending[0]
+                pending.remove(key)
+                running[executor.submit(_run_job, str(key), *jobs[key], shares[key], scheduler_start)] = key
+                free_cpus -= shares[key]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                results[key] = future.result()
+                free_cpus += shares[key]
+    makespan = time.time() - scheduler_start
+
+    rows = []
+    for rank, key in enumerate(order):
+        _, budget_run, start_offset, wall_time = results[key]
+        rows.append({'job': key, 'cost': job_costs[key], 'order': rank, 'cpus': shares[key],
+                     'start_seconds': start_offset, 'wall_seconds': wall_time,
+                     'worker_utilization': budget_run['worker_utilization']})
+    report = pd.DataFrame(rows).set_index('job')
+    report.attrs['makespan_seconds'] = makespan
+    report.attrs['sum_of_job_seconds'] = report['wall_seconds'].sum()
+    return {key: results[key][0] for key in order}, report
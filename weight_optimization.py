@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Ensemble weight solvers working on cached out-of-fold predictions.
+
+Minimizing the RMSE of a non-negative, sum-to-one blend of the base-model
+predictions is a small convex quadratic program, so the optimal weights can be
+computed directly instead of searched for with gp_minimize.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import combinations
+
+import numpy as np
+from scipy.optimize import nnls
+from skopt import Optimizer, gp_minimize, load
+from skopt.callbacks import CheckpointSaver, DeadlineStopper
+from skopt.space import Real
+
+
+def _constrained_lstsq(P, y):
+    # least squares subject to sum(w) == 1, the last weight is eliminated as 1 - sum(others)
+    if P.shape[1] == 1:
+        return np.ones(1)
+    last = P[:, -1]
+    w_rest = np.linalg.lstsq(P[:, :-1] - last[:, None], y - last, rcond=None)[0]
+    return np.append(w_rest, 1.0 - w_rest.sum())
+
+
+# exact solution: the optimum is the sum-to-one least-squares fit on one of the supports of w
+def _solve_active_set(P, y, tol):
+    n_models = P.shape[1]
+    best_weights, best_sse = None, np.inf
+    for size in range(1, n_models + 1):
+        for support in combinations(range(n_models), size):
+            support = list(support)
+            w_support = _constrained_lstsq(P[:, support], y)
+            if np.any(w_support < -tol):
+                continue
+            sse = np.sum((y - P[:, support] @ w_support) ** 2)
+            if sse < best_sse:
+                best_sse = sse
+                best_weights = np.zeros(n_models)
+                best_weights[support] = w_support
+    return best_weights
+
+
+def _solve_nnls(P, y, penalty):
+    # sum-to-one constraint enforced through a heavily weighted extra row
+    scale = np.sqrt(penalty * np.mean(P ** 2))
+    P_aug = np.vstack([P, np.full((1, P.shape[1]), scale)])
+    y_aug = np.append(y, scale)
+    return nnls(P_aug, y_aug)[0]
+
+
+# optimal non-negative, sum-to-one blend weights for the columns of P
+def solve_simplex_weights(P, y, method='qp', tol=1e-10, penalty=1e6):
+    P = np.asarray(P, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if method == 'qp':
+        if P.shape[1] > 12:
+            raise ValueError("method='qp' enumerates every support, use method='nnls' for more than 12 models")
+        weights = _solve_active_set(P, y, tol)
+    elif method == 'nnls':
+        weights = _solve_nnls(P, y, penalty)
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'qp' or 'nnls'")
+
+    weights = np.clip(weights, 0.0, None)
+    return weights / weights.sum()
+
+
+def fit_simplex_weights(oof, method='qp'):
+    return solve_simplex_weights(oof.valid_predictions, oof.y_train, method=method)
+
+
+# greedy forward ensemble selection with replacement (Caruana et al. 2004): starts from the n_init best
+# single members and repeatedly adds the member, possibly again, that lowers the RMSE of the running
+# average the most. Returns {member: selection count / total} of the best ensemble seen, which keeps the
+# weights sparse where the QP solvers above cannot handle hundreds of members
+def greedy_ensemble_selection(oof, n_iterations=100, n_init=1):
+    P, y = oof.valid_predictions, oof.y_train
+    single_rmse = np.sqrt(np.mean((P - y[:, None]) ** 2, axis=0))
+    counts = np.zeros(P.shape[1])
+    counts[np.argsort(single_rmse)[:n_init]] = 1
+    running_sum = P @ counts
+    best_counts, best_rmse = counts.copy(), float(np.sqrt(np.mean((running_sum / counts.sum() - y) ** 2)))
+    for _ in range(n_iterations):
+        size = counts.sum() + 1
+        candidate_rmse = np.sqrt(np.mean(((running_sum[:, None] + P) / size - y[:, None]) ** 2, axis=0))
+        choice = int(np.argmin(candidate_rmse))
+        counts[choice] += 1
+        running_sum += P[:, choice]
+        if candidate_rmse[choice] < best_rmse:
+            best_counts, best_rmse = counts.copy(), float(candidate_rmse[choice])
+    return {oof.model_names[i]: best_counts[i] / best_counts.sum() for i in np.flatnonzero(best_counts)}
+
+
+# random candidate weights drawn uniformly (alpha=1) from the simplex
+def sample_simplex_weights(n_samples, n_models, alpha=1.0, random_state=None):
+    rng = np.random.default_rng(random_state)
+    return rng.dirichlet(np.full(n_models, alpha), size=n_samples)
+
+
+# every weight vector on the simplex whose entries are multiples of step
+def simplex_grid(n_models, step=0.05):
+    n_steps = int(round(1.0 / step))
+    grid = []
+    for bars in combinations(range(n_steps + n_models - 1), n_models - 1):
+        edges = np.array((-1,) + bars + (n_steps + n_models - 1,))
+        grid.append(np.diff(edges) - 1)
+    return np.array(grid, dtype=float) / n_steps
+
+
+# scores a whole batch of candidate weights and returns the best one
+def sweep_weights(oof, weights_batch, normalize=True):
+    weights_batch = np.atleast_2d(np.asarray(weights_batch, dtype=float))
+    if normalize:
+        weights_batch = weights_batch / weights_batch.sum(axis=1, keepdims=True)
+    rmses = oof.rmse_batch(weights_batch)
+    best = int(np.argmin(rmses))
+    return weights_batch[best], float(rmses[best]), rmses
+
+
+# ask/tell Bayesian optimization: each round proposes batch_size points with a constant-liar
+# strategy ('cl_min', 'cl_mean' or 'cl_max') and evaluates them concurrently, which pays off when
+# the objective is expensive (no out-of-fold cache, or hyperparameters tuned jointly with the weights).
+# The objective has to be picklable for executor='process'; callbacks follow the gp_minimize convention.
+def batch_gp_minimize(objective, search_space, n_calls=50, batch_size=4, n_jobs=None, strategy='cl_min',
+                      n_initial_points=10, random_state=None, callback=None, executor='process'):
+    if executor not in ('process', 'thread'):
+        raise ValueError(f"Unknown executor '{executor}', expected 'process' or 'thread'")
+    callbacks = [] if callback is None else (callback if isinstance(callback, (list, tuple)) else [callback])
+    optimizer = Optimizer(search_space, base_estimator='GP', acq_func='gp_hedge',
+                          n_initial_points=n_initial_points, random_state=random_state)
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+
+    result = None
+    with pool_class(max_workers=n_jobs or batch_size) as pool:
+        while len(optimizer.Xi) < n_calls:
+            points = optimizer.ask(n_points=min(batch_size, n_calls - len(optimizer.Xi)), strategy=strategy)
+            values = list(pool.map(objective, points))
+            result = optimizer.tell(points, values)
+            if any(cb(result) for cb in callbacks):
+                break
+    return result
+
+
+# stick-breaking map from the (n_models - 1)-dimensional unit cube onto the simplex. Each coordinate
+# is pushed through the Beta(1, k) quantile of the remaining stick, so a uniform point in the cube
+# lands uniformly on the simplex and the vertices are reached at the cube bounds
+def stick_breaking(z):
+    z = np.asarray(z, dtype=float)
+    weights = np.empty(len(z) + 1)
+    remaining = 1.0
+    for i, z_i in enumerate(z):
+        fraction = 1.0 - (1.0 - z_i) ** (1.0 / (len(z) - i))
+        weights[i] = remaining * fraction
+        remaining -= weights[i]
+    weights[-1] = max(remaining, 0.0)
+    return weights
+
+
+def simplex_search_space(model_names):
+    return [Real(0, 1, name=f"{name}_stick") for name in model_names[:-1]]
+
+
+# gp_minimize directly on the simplex: n_models - 1 dimensions, no redundant scale dimension
+# and no two points mapping to the same blend. weight_objective receives normalized weights.
+def gp_minimize_simplex(weight_objective, model_names, n_calls=50, random_state=None, **kwargs):
+    def objective(z):
+        return weight_objective(stick_breaking(z))
+
+    result = gp_minimize(objective, simplex_search_space(model_names), n_calls=n_calls,
+                         random_state=random_state, **kwargs)
+    result.weights = stick_breaking(result.x)
+    return result
+
+
+# number of objective calls until the best value seen came within rtol of target, None if never
+def calls_to_reach(func_vals, target, rtol=1e-3):
+    best_so_far = np.minimum.accumulate(np.asarray(func_vals, dtype=float))
+    reached = np.nonzero(best_so_far <= target * (1.0 + rtol))[0]
+    return int(reached[0]) + 1 if len(reached) else None
+
+
+# gp_minimize callback: stops once the best value has not improved by more than tol over the last patience calls.
+# Only calls after the n_initial_points random ones count, so at least patience model-guided steps are taken
+class NoImprovementStopper:
+
+    def __init__(self, tol=1e-4, patience=10, n_initial_points=0):
+        self.tol = tol
+        self.patience = patience
+        self.n_initial_points = n_initial_points
+
+    def __call__(self, result):
+        best_so_far = np.minimum.accumulate(result.func_vals)
+        if len(best_so_far) - max(self.n_initial_points, 1) < self.patience:
+            return False
+        return best_so_far[-self.patience - 1] - best_so_far[-1] <= self.tol
+
+
+# gp_minimize with early stopping and checkpointing. tol/patience stop a converged run, time_budget
+# (seconds) stops a run that is taking too long, checkpoint_path saves the result after every call and
+# resume=True continues from an existing checkpoint, counting its evaluations against n_calls
+def gp_minimize_with_checkpoint(objective, search_space, n_calls=50, random_state=None, checkpoint_path=None,
+                                resume=False, tol=None, patience=10, time_budget=None, n_initial_points=10,
+                                callback=None, **kwargs):
+    callbacks = [] if callback is None else (list(callback) if isinstance(callback, (list, tuple)) else [callback])
+    if tol is not None:
+        callbacks.append(NoImprovementStopper(tol=tol, patience=patience, n_initial_points=n_initial_points))
+    if time_budget is not None:
+        callbacks.append(DeadlineStopper(time_budget))
+    if checkpoint_path is not None:
+        # the objective is usually a closure over the data, so only the evaluations are stored
+        callbacks.append(CheckpointSaver(checkpoint_path, store_objective=False))
+
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        previous = load(checkpoint_path)
+        x0, y0 = [list(x) for x in previous.x_iters], list(previous.func_vals)
+        if len(x0) >= n_calls:
+            return previous
+        kwargs.update(x0=x0, y0=y0)
+        n_calls -= len(x0)
+        n_initial_points = max(n_initial_points - len(x0), 0)
+        # the same seed would draw the random points the checkpoint already evaluated
+        if isinstance(random_state, (int, np.integer)):
+            random_state = random_state + len(x0)
+
+    return gp_minimize(objective, search_space, n_calls=n_calls, random_state=random_state,
+                       n_initial_points=n_initial_points, callback=callbacks, **kwargs)